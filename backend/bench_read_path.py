@@ -0,0 +1,110 @@
+"""Microbenchmark: per-item cost of the validated vs trusted read path.
+
+The validated path mirrors what a route did before: build models from the Mongo
+documents, then let FastAPI dump them, validate them again against response_model
+and JSON-encode the result. The trusted path is ``render_documents``: construct
+models without validation and serialize them to JSON in one step.
+
+    python bench_read_path.py --items 200 --payload-kb 64
+"""
+import argparse
+import base64
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+# server.py reads these at import time; nothing connects to Mongo here
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "bench")
+
+from server import Photo, PhotoSummary, BirthdayWish, list_adapter  # noqa: E402
+
+def photo_document(index: int, payload: str) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": "user-1",
+        "title": f"Photo {index}",
+        "description": "Birthday party",
+        "image_data": payload,
+        "file_size": len(payload),
+        "mime_type": "image/jpeg",
+        "uploaded_at": datetime(2024, 1, 1) + timedelta(minutes=index),
+        "likes": ["user-2", "user-3"],
+        "like_count": 2,
+        "comment_count": 1,
+        "recent_comments": [{"id": "c1", "user_id": "user-2", "comment": "Lovely!", "created_at": datetime(2024, 1, 2)}],
+    }
+
+def summary_document(index: int) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": "user-1",
+        "title": f"Photo {index}",
+        "description": "Birthday party",
+        "file_size": 123456,
+        "mime_type": "image/jpeg",
+        "uploaded_at": datetime(2024, 1, 1) + timedelta(minutes=index),
+        "like_count": 2,
+        "comment_count": 1,
+        "is_featured": False,
+        "content_url": f"/api/photos/{index}/content",
+        "thumbnail_url": f"/api/photos/{index}/thumbnail",
+    }
+
+def wish_document(index: int) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": "user-1",
+        "user_name": "Guest",
+        "message": "Happy birthday! " * 10,
+        "created_at": datetime(2024, 1, 1) + timedelta(minutes=index),
+        "like_count": 0,
+    }
+
+def validated_path(model, documents):
+    # Handler: Model(**doc); FastAPI: dump, validate against response_model, serialize, json.dumps
+    adapter = list_adapter(model)
+    models = [model(**document) for document in documents]
+    content = [item.model_dump(by_alias=True) for item in models]
+    value = adapter.validate_python(content)
+    data = adapter.dump_python(value, mode="json")
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+def trusted_path(model, documents):
+    return list_adapter(model).dump_json([model.model_construct(**document) for document in documents])
+
+def measure(function, model, documents, repeat: int) -> float:
+    """Best per-item time in microseconds over ``repeat`` runs"""
+    function(model, documents)  # warm up adapters and caches
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(model, documents)
+        best = min(best, time.perf_counter() - start)
+    return best / len(documents) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--payload-kb", type=int, default=64, help="size of the legacy base64 image per photo")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    payload = base64.b64encode(os.urandom(args.payload_kb * 1024 * 3 // 4)).decode()
+    cases = [
+        (f"Photo ({args.payload_kb} KB base64)", Photo, [photo_document(i, payload) for i in range(args.items)]),
+        ("PhotoSummary", PhotoSummary, [summary_document(i) for i in range(args.items)]),
+        ("BirthdayWish", BirthdayWish, [wish_document(i) for i in range(args.items)]),
+    ]
+
+    print(f"{'model':<28}{'validated us/item':>20}{'trusted us/item':>18}{'speedup':>10}")
+    for name, model, documents in cases:
+        assert json.loads(validated_path(model, documents)) == json.loads(trusted_path(model, documents))
+        before = measure(validated_path, model, documents, args.repeat)
+        after = measure(trusted_path, model, documents, args.repeat)
+        print(f"{name:<28}{before:>20.1f}{after:>18.1f}{before / after:>9.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,32 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, WebSocket, WebSocketDisconnect
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, WebSocket, WebSocketDisconnect, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, IndexModel, ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import OperationFailure, BulkWriteError, DuplicateKeyError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, TypeAdapter
+from typing import List, Optional, Dict, Any, Set, Callable, Tuple
 import uuid
 from datetime import datetime
 import base64
+import hashlib
 import json
 import asyncio
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+import time
+import random
+import functools
+from contextlib import asynccontextmanager
+
+try:
+    import msgpack
+except ImportError:  # optional: websocket clients then always get JSON
+    msgpack = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -28,35 +42,672 @@ app = FastAPI(title="Birthday Celebration API", version="1.0.0")
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+# Background work that runs on a timer (write-behind flushes, sweeps). Tasks are
+# started with the app and stopped on shutdown, where they get one last run.
+class PeriodicTask:
+    def __init__(self, name: str, interval: float, callback: Callable[[], Any]):
+        self.name = name
+        self.interval = interval
+        self.callback = callback
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def _run_once(self):
+        try:
+            await self.callback()
+        except Exception:
+            logger.exception(f"Periodic task {self.name} failed")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self._run_once()
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self._run_once()
+
+periodic_tasks: List[PeriodicTask] = []
+
+async def insert_write_behind(collection, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Insert a write-behind batch; returns the documents that should be retried.
+
+    Duplicate key errors mean an earlier, partially failed attempt already wrote the
+    document, so those are not retried.
+    """
+    try:
+        await collection.insert_many(batch, ordered=False)
+    except BulkWriteError as e:
+        failed = sorted(
+            error["index"] for error in e.details.get("writeErrors", []) if error.get("code") != 11000
+        )
+        if failed:
+            logger.warning(f"Write-behind insert into {collection.name} failed for {len(failed)} documents")
+        return [batch[index] for index in failed]
+    except Exception as e:
+        logger.warning(f"Write-behind insert into {collection.name} failed: {e}")
+        return batch
+    return []
+
+def run_periodically(name: str, interval: float, callback: Callable[[], Any]) -> PeriodicTask:
+    task = PeriodicTask(name, interval, callback)
+    periodic_tasks.append(task)
+    return task
+
 # WebSocket connection manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-        self.user_connections: Dict[str, WebSocket] = {}
+TOPIC_PREFIXES = ("game:", "watch:")
+STATIC_TOPICS = {"gallery", "wishes", "presence"}
+
+def is_valid_topic(topic: str) -> bool:
+    """Topics are either a fixed channel or a room keyed by id (``game:{id}``, ``watch:{id}``)"""
+    if topic in STATIC_TOPICS:
+        return True
+    return any(topic.startswith(prefix) and len(topic) > len(prefix) for prefix in TOPIC_PREFIXES)
+
+# Outbound fan-out tuning: every socket gets a bounded queue drained by its own writer task
+WS_QUEUE_SIZE = int(os.environ.get("WS_QUEUE_SIZE", "256"))
+WS_SEND_TIMEOUT = float(os.environ.get("WS_SEND_TIMEOUT", "10"))
+WS_OVERFLOW_POLICY = os.environ.get("WS_OVERFLOW_POLICY", "evict")  # "evict" or "drop_oldest"
+# Keepalive: quiet sockets are pinged, and reaped once nothing was received for WS_IDLE_TIMEOUT
+WS_PING_INTERVAL = float(os.environ.get("WS_PING_INTERVAL", "20"))
+WS_IDLE_TIMEOUT = float(os.environ.get("WS_IDLE_TIMEOUT", "60"))
+
+# Wire formats a client can ask for with ``/ws/{user_id}?encoding=``; JSON is always available
+WS_ENCODINGS = ("json", "msgpack") if msgpack is not None else ("json",)
+
+def negotiate_encoding(requested: Optional[str]) -> str:
+    return requested if requested in WS_ENCODINGS else "json"
+
+class Frame:
+    """An outbound message, encoded at most once per wire format however many sockets get it"""
+
+    __slots__ = ("message", "encoded")
+
+    def __init__(self, message: dict):
+        self.message = message
+        self.encoded: Dict[str, Any] = {}
+
+    def encode(self, encoding: str):
+        data = self.encoded.get(encoding)
+        if data is None:
+            if encoding == "msgpack":
+                data = msgpack.packb(self.message, default=str, use_bin_type=True)
+            else:
+                data = json.dumps(self.message, default=str)
+            self.encoded[encoding] = data
+        return data
+
+def decode_client_frame(received: Dict[str, Any]) -> dict:
+    """Parse an inbound websocket frame: JSON text, or msgpack bytes from binary clients"""
+    if received.get("bytes") is not None:
+        if msgpack is None:
+            raise ValueError("Binary frames are not supported")
+        message = msgpack.unpackb(received["bytes"], raw=False)
+    else:
+        message = json.loads(received["text"])
+    if not isinstance(message, dict):
+        raise ValueError("Frames must be objects")
+    return message
+
+class ClientConnection:
+    """A connected socket with its outbound queue and writer task"""
+
+    def __init__(self, websocket: WebSocket, user_id: str, encoding: str = "json"):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.encoding = encoding
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_QUEUE_SIZE)
+        self.topics: Set[str] = set()
+        self.writer: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.closed = False
+        self.last_seen = time.monotonic()  # last frame received from the client
+        self.last_ping = 0.0
+
+    def enqueue(self, frame: Frame) -> bool:
+        """Queue a frame without waiting; returns False if the client should be evicted"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            if WS_OVERFLOW_POLICY != "drop_oldest":
+                return False
+            self.queue.get_nowait()
+            self.queue.put_nowait(frame)
+            self.dropped += 1
+        return True
+
+# Cross-worker relay for websocket events. Every worker delivers to its own sockets;
+# the backplane only carries events between workers.
+WS_BACKPLANE = os.environ.get("WS_BACKPLANE", "memory")  # "memory" or "unix"
+WS_BACKPLANE_DIR = os.environ.get("WS_BACKPLANE_DIR", "/tmp/birthday-ws-backplane")
+WS_BACKPLANE_QUEUE_SIZE = int(os.environ.get("WS_BACKPLANE_QUEUE_SIZE", "10000"))
+
+class Backplane:
+    """Interface for relaying events to the other workers"""
+
+    async def start(self, on_event: Callable[[dict], None]):
+        raise NotImplementedError
+
+    async def publish(self, event: dict):
+        raise NotImplementedError
+
+    async def stop(self):
+        pass
+
+class InProcessBackplane(Backplane):
+    """Relays between backplanes sharing the same hub inside one process.
+
+    With the default private hub this is a single-node setup where there is nobody to relay to.
+    """
+
+    def __init__(self, hub: Optional[List["InProcessBackplane"]] = None):
+        self.hub = hub if hub is not None else []
+        self.on_event: Optional[Callable[[dict], None]] = None
+
+    async def start(self, on_event: Callable[[dict], None]):
+        self.on_event = on_event
+        self.hub.append(self)
+
+    async def publish(self, event: dict):
+        for peer in list(self.hub):
+            if peer is not self and peer.on_event is not None:
+                peer.on_event(event)
+
+    async def stop(self):
+        if self in self.hub:
+            self.hub.remove(self)
+
+class UnixSocketBackplane(Backplane):
+    """Mesh of workers on one machine.
+
+    Each worker listens on ``<directory>/<node_id>.sock`` and streams newline-delimited JSON
+    events to every other socket in the directory. Sockets left behind by dead workers are
+    removed when a connection to them is refused.
+    """
+
+    PEER_REFRESH_SECONDS = 2.0
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.node_id = uuid.uuid4().hex
+        self.path = self.directory / f"{self.node_id}.sock"
+        self.on_event: Optional[Callable[[dict], None]] = None
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=WS_BACKPLANE_QUEUE_SIZE)
+        self.sender: Optional[asyncio.Task] = None
+        self.peers: Dict[Path, Optional[asyncio.StreamWriter]] = {}
+        self.peers_refreshed_at = 0.0
+
+    async def start(self, on_event: Callable[[dict], None]):
+        self.on_event = on_event
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.server = await asyncio.start_unix_server(self._serve_peer, path=str(self.path))
+        self.sender = asyncio.create_task(self._send_loop())
+
+    async def publish(self, event: dict):
+        try:
+            self.outbox.put_nowait(event)
+        except asyncio.QueueFull:
+            logger.warning("Backplane outbox full, dropping event")
+
+    async def stop(self):
+        if self.sender is not None:
+            self.sender.cancel()
+        for writer in self.peers.values():
+            if writer is not None:
+                writer.close()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.path.unlink(missing_ok=True)
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                self.on_event(event)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def _refresh_peers(self):
+        found = {path for path in self.directory.glob("*.sock") if path != self.path}
+        for path in list(self.peers):
+            if path not in found:
+                writer = self.peers.pop(path)
+                if writer is not None:
+                    writer.close()
+        for path in found:
+            self.peers.setdefault(path, None)
+        self.peers_refreshed_at = time.monotonic()
+
+    async def _send_loop(self):
+        while True:
+            event = await self.outbox.get()
+            if time.monotonic() - self.peers_refreshed_at > self.PEER_REFRESH_SECONDS:
+                self._refresh_peers()
+            data = (json.dumps(event, default=str) + "\n").encode()
+            for path, writer in list(self.peers.items()):
+                try:
+                    if writer is None or writer.is_closing():
+                        _, writer = await asyncio.open_unix_connection(str(path))
+                        self.peers[path] = writer
+                    writer.write(data)
+                    await writer.drain()
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # The worker behind this socket is gone
+                    self.peers.pop(path, None)
+                    path.unlink(missing_ok=True)
+                except OSError as e:
+                    logger.warning(f"Backplane peer {path.name} failed: {e}")
+                    self.peers[path] = None
+
+def create_backplane() -> Backplane:
+    if WS_BACKPLANE == "unix":
+        return UnixSocketBackplane(WS_BACKPLANE_DIR)
+    return InProcessBackplane()
 
-    async def connect(self, websocket: WebSocket, user_id: str):
+class ConnectionManager:
+    def __init__(self, backplane: Optional[Backplane] = None):
+        self.backplane = backplane or InProcessBackplane()
+        # Extra relay kinds (beyond broadcast/topic/user) handled by other subsystems
+        self.relay_handlers: Dict[str, Callable[[dict], None]] = {}
+        self.started = False
+        self.active_connections: Dict[WebSocket, ClientConnection] = {}
+        # user_id -> that user's sockets (one per open tab or device)
+        self.user_connections: Dict[str, Set[ClientConnection]] = {}
+        # topic -> connections subscribed to it
+        self.topics: Dict[str, Set[ClientConnection]] = {}
+        self.evicted_count = 0
+        self.reaped_count = 0  # evictions of sockets that went quiet
+        self.pings_sent = 0
+
+    async def start(self):
+        await self.backplane.start(self._handle_relay)
+        self.started = True
+
+    async def stop(self):
+        self.started = False
+        await self.backplane.stop()
+
+    def on_relay(self, kind: str, handler: Callable[[dict], None]):
+        """Register a handler for events of ``kind`` relayed from other workers"""
+        self.relay_handlers[kind] = handler
+
+    async def relay(self, kind: str, payload: dict):
+        """Send an event of ``kind`` to the other workers"""
+        if self.started:
+            await self.backplane.publish({"kind": kind, "payload": payload})
+
+    def _handle_relay(self, event: dict):
+        kind = event.get("kind")
+        payload = event.get("payload") or {}
+        if kind == "broadcast":
+            self._deliver(self.active_connections.values(), payload["message"])
+        elif kind == "topic":
+            self._deliver(self.topics.get(payload["topic"], ()), payload["message"])
+        elif kind == "user":
+            self._deliver(self.user_connections.get(payload["user_id"], ()), payload["message"])
+        elif kind == "subscribe_user":
+            self._subscribe_user_local(payload["user_id"], payload["topic"])
+        elif kind in self.relay_handlers:
+            self.relay_handlers[kind](payload)
+
+    async def connect(self, websocket: WebSocket, user_id: str, encoding: str = "json") -> ClientConnection:
         await websocket.accept()
-        self.active_connections.append(websocket)
-        self.user_connections[user_id] = websocket
+        connection = ClientConnection(websocket, user_id, encoding)
+        connection.writer = asyncio.create_task(self._write_loop(connection))
+        self.active_connections[websocket] = connection
+        self.user_connections.setdefault(user_id, set()).add(connection)
+        return connection
 
     def disconnect(self, websocket: WebSocket, user_id: str):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-        if user_id in self.user_connections:
-            del self.user_connections[user_id]
+        connection = self.active_connections.pop(websocket, None)
+        if connection is None:
+            return
+        connection.closed = True
+        sockets = self.user_connections.get(user_id)
+        if sockets is not None:
+            sockets.discard(connection)
+            if not sockets:
+                del self.user_connections[user_id]
+        for topic in connection.topics:
+            members = self.topics.get(topic)
+            if members is not None:
+                members.discard(connection)
+                if not members:
+                    del self.topics[topic]
+        connection.topics.clear()
+        if connection.writer is not None and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+
+    def evict(self, connection: ClientConnection, reason: str):
+        """Drop a slow or broken client and close its socket in the background"""
+        if connection.closed:
+            return
+        logger.warning(f"Evicting websocket for user {connection.user_id}: {reason}")
+        self.evicted_count += 1
+        self.disconnect(connection.websocket, connection.user_id)
+        asyncio.create_task(self._close_quietly(connection.websocket))
+
+    def ping(self, connection: ClientConnection):
+        connection.last_ping = time.monotonic()
+        self.pings_sent += 1
+        self._deliver((connection,), {"type": "ping", "server_time": time.time()})
+
+    def reap_idle(self) -> List[ClientConnection]:
+        """Ping quiet sockets and evict the ones silent for WS_IDLE_TIMEOUT; returns the evicted"""
+        now = time.monotonic()
+        reaped = []
+        for connection in list(self.active_connections.values()):
+            if now - connection.last_seen > WS_IDLE_TIMEOUT:
+                self.reaped_count += 1
+                self.evict(connection, "idle timeout")
+                reaped.append(connection)
+            elif now - max(connection.last_seen, connection.last_ping) >= WS_PING_INTERVAL:
+                self.ping(connection)
+        return reaped
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "connections": len(self.active_connections),
+            "users": len(self.user_connections),
+            "topics": len(self.topics),
+            "evicted": self.evicted_count,
+            "reaped": self.reaped_count,
+            "pings_sent": self.pings_sent,
+            "dropped_messages": sum(connection.dropped for connection in self.active_connections.values())
+        }
+
+    async def _close_quietly(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            pass
+
+    async def _write_loop(self, connection: ClientConnection):
+        try:
+            while True:
+                frame = await connection.queue.get()
+                data = frame.encode(connection.encoding)
+                if isinstance(data, bytes):
+                    send = connection.websocket.send_bytes(data)
+                else:
+                    send = connection.websocket.send_text(data)
+                await asyncio.wait_for(send, timeout=WS_SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.evict(connection, f"send failed ({type(e).__name__})")
+
+    def subscribe(self, websocket: WebSocket, topic: str):
+        connection = self.active_connections.get(websocket)
+        if connection is None:
+            return
+        self.topics.setdefault(topic, set()).add(connection)
+        connection.topics.add(topic)
+
+    def unsubscribe(self, websocket: WebSocket, topic: str):
+        connection = self.active_connections.get(websocket)
+        if connection is None:
+            return
+        members = self.topics.get(topic)
+        if members is not None:
+            members.discard(connection)
+            if not members:
+                del self.topics[topic]
+        connection.topics.discard(topic)
+
+    def is_subscribed(self, websocket: WebSocket, topic: str) -> bool:
+        connection = self.active_connections.get(websocket)
+        return connection is not None and topic in connection.topics
+
+    def _subscribe_user_local(self, user_id: str, topic: str):
+        for connection in self.user_connections.get(user_id, ()):
+            self.subscribe(connection.websocket, topic)
+
+    async def subscribe_user(self, user_id: str, topic: str):
+        """Subscribe a user's live sockets to a topic, e.g. after joining a room over HTTP.
+
+        The user's sockets may be held by other workers, so the subscription is relayed too.
+        """
+        self._subscribe_user_local(user_id, topic)
+        await self.relay("subscribe_user", {"user_id": user_id, "topic": topic})
+
+    def _deliver(self, connections, message: dict):
+        # One frame for all recipients: each wire format is encoded once, on first send
+        frame = Frame(message)
+        for connection in list(connections):
+            if not connection.enqueue(frame):
+                self.evict(connection, "outbound queue full")
+
+    async def send(self, websocket: WebSocket, message: dict):
+        """Reply on a specific socket, going through its writer like every other message"""
+        connection = self.active_connections.get(websocket)
+        if connection is not None:
+            self._deliver((connection,), message)
 
     async def send_personal_message(self, message: dict, user_id: str):
-        if user_id in self.user_connections:
-            await self.user_connections[user_id].send_text(json.dumps(message))
+        self._deliver(self.user_connections.get(user_id, ()), message)
+        await self.relay("user", {"user_id": user_id, "message": message})
+
+    def publish_local(self, topic: str, message: dict):
+        """Deliver to this worker's subscribers of ``topic`` only"""
+        self._deliver(self.topics.get(topic, ()), message)
+
+    async def publish(self, topic: str, message: dict, relay: bool = True):
+        """Send a message only to the connections subscribed to ``topic``"""
+        self.publish_local(topic, message)
+        if relay:
+            await self.relay("topic", {"topic": topic, "message": message})
 
     async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(json.dumps(message))
-            except:
-                pass
+        self._deliver(self.active_connections.values(), message)
+        await self.relay("broadcast", {"message": message})
+
+manager = ConnectionManager(create_backplane())
+
+# =============================================================================
+# BLOB STORAGE
+# =============================================================================
+
+BLOB_DIR = Path(os.environ.get("BLOB_DIR", str(ROOT_DIR / "blobs")))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_PHOTO_BYTES = int(os.environ.get("MAX_PHOTO_BYTES", str(25 * 1024 * 1024)))
+MAX_VIDEO_BYTES = int(os.environ.get("MAX_VIDEO_BYTES", str(1024 * 1024 * 1024)))
+
+class StoredBlob(BaseModel):
+    key: str
+    size: int
+    checksum: str  # sha256 hex digest
+    mime_type: str
+
+class BlobStore:
+    """Uploaded media kept on local disk, addressed by an opaque key"""
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def path_for(self, key: str) -> Path:
+        # Shard by key prefix so no single directory grows unbounded
+        return self.root / key[:2] / key
+
+    async def save_upload(self, upload: UploadFile, max_bytes: int) -> StoredBlob:
+        """Stream an upload to disk in chunks, hashing as we go"""
+        key = uuid.uuid4().hex
+        path = self.path_for(key)
+        partial = path.with_suffix(".part")
+        await asyncio.to_thread(path.parent.mkdir, parents=True, exist_ok=True)
+        
+        digest = hashlib.sha256()
+        size = 0
+        handle = await asyncio.to_thread(open, partial, "wb")
+        try:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail="File too large")
+                digest.update(chunk)
+                await asyncio.to_thread(handle.write, chunk)
+            await asyncio.to_thread(handle.close)
+            await asyncio.to_thread(os.replace, partial, path)
+        except BaseException:
+            handle.close()
+            partial.unlink(missing_ok=True)
+            raise
+        
+        return StoredBlob(
+            key=key,
+            size=size,
+            checksum=digest.hexdigest(),
+            mime_type=upload.content_type or "application/octet-stream"
+        )
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self.path_for(key).unlink, missing_ok=True)
+
+blob_store = BlobStore(BLOB_DIR)
+
+# =============================================================================
+# THUMBNAILS
+# =============================================================================
+
+# Longest edge in pixels; "poster" is a full-size frame and only generated for videos
+THUMBNAIL_SIZES = {"small": 160, "medium": 480, "large": 1024}
+DEFAULT_THUMBNAIL_SIZE = "medium"
+THUMBNAIL_WORKERS = int(os.environ.get("THUMBNAIL_WORKERS", "2"))
+THUMBNAIL_INDEX_SIZE = 4096
+
+thumbnail_pool: Optional[ProcessPoolExecutor] = None
+thumbnail_tasks: Set[asyncio.Task] = set()
+# (kind, item_id, size) -> stored thumbnail metadata; thumbnails never change once written
+thumbnail_index: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+
+def render_thumbnails(source: str, is_video: bool, blob_root: str) -> Dict[str, Dict[str, Any]]:
+    """Write a JPEG per thumbnail size into the blob store. Runs in a worker process."""
+    from PIL import Image, ImageOps
+    
+    if is_video:
+        import cv2
+        capture = cv2.VideoCapture(source)
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        if frame_count > 0:
+            # Skip black intro frames: take the poster about a tenth of the way in
+            capture.set(cv2.CAP_PROP_POS_FRAMES, frame_count // 10)
+        ok, frame = capture.read()
+        capture.release()
+        if not ok:
+            raise ValueError("Could not decode a video frame")
+        image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    else:
+        with Image.open(source) as original:
+            image = ImageOps.exif_transpose(original).convert("RGB")
+    
+    sizes: Dict[str, Optional[int]] = dict(THUMBNAIL_SIZES)
+    if is_video:
+        sizes["poster"] = None
+    
+    store = BlobStore(Path(blob_root))
+    results = {}
+    for name, edge in sizes.items():
+        thumbnail = image.copy()
+        if edge is not None:
+            thumbnail.thumbnail((edge, edge), Image.LANCZOS)
+        key = uuid.uuid4().hex
+        path = store.path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        thumbnail.save(path, "JPEG", quality=85, optimize=True)
+        results[name] = {
+            "key": key,
+            "width": thumbnail.width,
+            "height": thumbnail.height,
+            "size": path.stat().st_size
+        }
+    return results
+
+def get_thumbnail_pool() -> ProcessPoolExecutor:
+    global thumbnail_pool
+    if thumbnail_pool is None:
+        thumbnail_pool = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+    return thumbnail_pool
+
+async def generate_thumbnails(kind: str, item_id: str, blob_key: str):
+    """Render thumbnails for an uploaded photo/video and tell the gallery when they are ready"""
+    collection = db.photos if kind == "photos" else db.videos
+    source = str(blob_store.path_for(blob_key))
+    loop = asyncio.get_running_loop()
+    try:
+        thumbnails = await loop.run_in_executor(
+            get_thumbnail_pool(), render_thumbnails, source, kind == "videos", str(BLOB_DIR)
+        )
+    except Exception as e:
+        logger.warning(f"Thumbnail generation failed for {kind}/{item_id}: {e}")
+        return
+    
+    await collection.update_one({"id": item_id}, {"$set": {"thumbnails": thumbnails}})
+    await document_cache.invalidate(kind, item_id)
+    await change_counters.bump(kind)
+    await manager.publish("gallery", {
+        "type": "thumbnail_ready",
+        "kind": kind,
+        "item_id": item_id,
+        "sizes": list(thumbnails),
+        "thumbnail_url": f"/api/{kind}/{item_id}/thumbnail"
+    })
 
-manager = ConnectionManager()
+def schedule_thumbnails(kind: str, item_id: str, blob_key: str):
+    task = asyncio.create_task(generate_thumbnails(kind, item_id, blob_key))
+    # Keep a reference so the task is not garbage collected mid-flight
+    thumbnail_tasks.add(task)
+    task.add_done_callback(thumbnail_tasks.discard)
+
+async def thumbnail_response(kind: str, item_id: str, size: str, legacy_mime_type: Optional[str] = None) -> Response:
+    """Serve a generated thumbnail, falling back to a legacy base64 ``thumbnail_data``"""
+    if size not in THUMBNAIL_SIZES and not (size == "poster" and kind == "videos"):
+        raise HTTPException(status_code=400, detail=f"Unknown thumbnail size: {size}")
+    
+    cache_key = (kind, item_id, size)
+    thumbnail = thumbnail_index.get(cache_key)
+    if thumbnail is None:
+        collection = db.photos if kind == "photos" else db.videos
+        document = await collection.find_one({"id": item_id}, {"thumbnails": 1, "thumbnail_data": 1, "mime_type": 1})
+        if not document:
+            raise HTTPException(status_code=404, detail=f"{kind[:-1].capitalize()} not found")
+        thumbnail = (document.get("thumbnails") or {}).get(size)
+        if thumbnail is None:
+            mime_type = legacy_mime_type or document.get("mime_type", "image/jpeg")
+            return media_response({**document, "blob_key": None, "mime_type": mime_type}, "thumbnail_data")
+        thumbnail_index[cache_key] = thumbnail
+        if len(thumbnail_index) > THUMBNAIL_INDEX_SIZE:
+            thumbnail_index.popitem(last=False)
+    else:
+        thumbnail_index.move_to_end(cache_key)
+    
+    return FileResponse(
+        blob_store.path_for(thumbnail["key"]),
+        media_type="image/jpeg",
+        headers={"Cache-Control": "public, max-age=86400", "ETag": f'"{thumbnail["key"]}"'}
+    )
 
 # =============================================================================
 # DATA MODELS
@@ -92,21 +743,46 @@ class Photo(BaseModel):
     user_id: str
     title: str
     description: Optional[str] = None
-    image_data: str  # base64 encoded image
+    image_data: Optional[str] = None  # legacy base64 image, new uploads live in the blob store
+    blob_key: Optional[str] = None
+    checksum: Optional[str] = None
     thumbnail_data: Optional[str] = None
+    thumbnails: Dict[str, Dict[str, Any]] = {}  # size -> generated thumbnail blob
     file_size: int
     mime_type: str
     uploaded_at: datetime = Field(default_factory=datetime.utcnow)
     likes: List[str] = []  # user_ids who liked
-    comments: List[Dict[str, Any]] = []
+    like_count: int = 0
+    comments: List[Dict[str, Any]] = []  # legacy embedded comments, now in photo_comments
+    comment_count: int = 0
+    recent_comments: List[Dict[str, Any]] = []  # latest few, newest last
     is_featured: bool = False
 
+class PhotoComment(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    photo_id: str
+    user_id: str
+    comment: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
 class PhotoCreate(BaseModel):
     title: str
     description: Optional[str] = None
-    image_data: str
-    mime_type: str
+
+class PhotoSummary(BaseModel):
+    """Gallery list entry: metadata only, content is fetched from ``content_url``"""
+    id: str
+    user_id: str
+    title: str
+    description: Optional[str] = None
     file_size: int
+    mime_type: str
+    uploaded_at: datetime
+    is_featured: bool = False
+    like_count: int = 0
+    comment_count: int = 0
+    content_url: str
+    thumbnail_url: Optional[str] = None
 
 class PhotoUpdate(BaseModel):
     title: Optional[str] = None
@@ -119,23 +795,40 @@ class Video(BaseModel):
     user_id: str
     title: str
     description: Optional[str] = None
-    video_data: str  # base64 encoded video
+    video_data: Optional[str] = None  # legacy base64 video, new uploads live in the blob store
+    blob_key: Optional[str] = None
+    checksum: Optional[str] = None
     thumbnail_data: Optional[str] = None
+    thumbnails: Dict[str, Dict[str, Any]] = {}  # size -> generated thumbnail blob
     file_size: int
     mime_type: str
     duration: Optional[int] = None  # in seconds
     uploaded_at: datetime = Field(default_factory=datetime.utcnow)
     likes: List[str] = []
+    like_count: int = 0
     comments: List[Dict[str, Any]] = []
     views: int = 0
 
 class VideoCreate(BaseModel):
     title: str
     description: Optional[str] = None
-    video_data: str
-    mime_type: str
+    duration: Optional[int] = None
+
+class VideoSummary(BaseModel):
+    """Gallery list entry: metadata only, content is fetched from ``content_url``"""
+    id: str
+    user_id: str
+    title: str
+    description: Optional[str] = None
     file_size: int
+    mime_type: str
     duration: Optional[int] = None
+    uploaded_at: datetime
+    views: int = 0
+    like_count: int = 0
+    comment_count: int = 0
+    content_url: str
+    thumbnail_url: Optional[str] = None
 
 # Birthday Wishes Models
 class BirthdayWish(BaseModel):
@@ -146,6 +839,7 @@ class BirthdayWish(BaseModel):
     is_anonymous: bool = False
     created_at: datetime = Field(default_factory=datetime.utcnow)
     likes: List[str] = []
+    like_count: int = 0
     is_approved: bool = True
 
 class BirthdayWishCreate(BaseModel):
@@ -160,6 +854,8 @@ class GameSession(BaseModel):
     game_state: Dict[str, Any]
     status: str = "waiting"  # "waiting", "active", "completed"
     winner: Optional[str] = None
+    seq: int = 0  # number of moves applied, matches game_moves entries
+    version: int = 0  # bumped by every conditional write of the session document
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -167,6 +863,7 @@ class GameMove(BaseModel):
     game_id: str
     player_id: str
     move_data: Dict[str, Any]
+    move_id: Optional[str] = None  # client generated, so a retried request is applied once
 
 # Watch Together Models
 class WatchSession(BaseModel):
@@ -178,6 +875,7 @@ class WatchSession(BaseModel):
     participants: List[str]
     current_time: float = 0.0
     is_playing: bool = False
+    playback_rate: float = 1.0
     created_at: datetime = Field(default_factory=datetime.utcnow)
     chat_messages: List[Dict[str, Any]] = []
 
@@ -187,8 +885,9 @@ class WatchSessionCreate(BaseModel):
     platform: str
 
 class WatchControl(BaseModel):
-    action: str  # "play", "pause", "seek"
+    action: str  # "play", "pause", "seek", "rate"
     timestamp: Optional[float] = None
+    rate: Optional[float] = None
 
 # Video Call Models
 class VideoCallSession(BaseModel):
@@ -200,6 +899,333 @@ class VideoCallSession(BaseModel):
     ended_at: Optional[datetime] = None
     duration: Optional[int] = None
 
+# =============================================================================
+# DATABASE INDEXES
+# =============================================================================
+
+# Every query the API runs should be served by one of these. Names are fixed so the
+# check mode can compare what exists against what we declare.
+INDEX_REGISTRY: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "photos": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("uploaded_at", DESCENDING), ("id", DESCENDING)], name="uploaded_at_id"),
+        IndexModel([("is_featured", ASCENDING), ("uploaded_at", DESCENDING), ("id", DESCENDING)], name="featured_uploaded_at_id"),
+    ],
+    "videos": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("uploaded_at", DESCENDING), ("id", DESCENDING)], name="uploaded_at_id"),
+    ],
+    "birthday_wishes": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("is_approved", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="approved_created_at_id"),
+    ],
+    "game_sessions": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING)], name="status_created_at"),
+    ],
+    "photo_comments": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("photo_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="photo_created_at_id"),
+    ],
+    "game_moves": [
+        IndexModel([("game_id", ASCENDING), ("seq", ASCENDING)], name="game_seq_unique", unique=True),
+        IndexModel(
+            [("game_id", ASCENDING), ("move_id", ASCENDING)], name="game_move_id_unique", unique=True,
+            partialFilterExpression={"move_id": {"$type": "string"}}
+        ),
+    ],
+    "watch_sessions": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "watch_chat": [
+        IndexModel([("session_id", ASCENDING), ("timestamp", DESCENDING)], name="session_timestamp"),
+    ],
+    "video_calls": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+}
+
+INDEX_MODE = os.environ.get("INDEX_MODE", "apply")  # "apply", "check" or "off"
+
+async def ensure_indexes():
+    """Create every registered index; existing ones are left untouched by Mongo"""
+    for collection_name, indexes in INDEX_REGISTRY.items():
+        try:
+            await db[collection_name].create_indexes(indexes)
+        except OperationFailure as e:
+            # e.g. duplicate emails already stored: report it but keep serving
+            logger.error(f"Could not create indexes on {collection_name}: {e}")
+
+async def check_indexes() -> Dict[str, Dict[str, List[str]]]:
+    """Compare live indexes against the registry.
+
+    Reports, per collection, registered indexes that are missing (or whose keys differ),
+    indexes that exist but are not registered, and indexes never used since the server
+    started according to $indexStats.
+    """
+    report = {}
+    for collection_name, indexes in INDEX_REGISTRY.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        declared = {index.document["name"]: list(index.document["key"].items()) for index in indexes}
+        
+        missing = [
+            name for name, keys in declared.items()
+            if name not in existing or [(field, int(direction)) for field, direction in existing[name]["key"]] != keys
+        ]
+        unregistered = [name for name in existing if name != "_id_" and name not in declared]
+        
+        unused = []
+        async for stats in collection.aggregate([{"$indexStats": {}}]):
+            if stats["name"] != "_id_" and stats["accesses"]["ops"] == 0:
+                unused.append(stats["name"])
+        
+        report[collection_name] = {"missing": missing, "unregistered": unregistered, "unused": sorted(unused)}
+    return report
+
+async def bootstrap_indexes():
+    if INDEX_MODE == "apply":
+        await ensure_indexes()
+    elif INDEX_MODE == "check":
+        report = await check_indexes()
+        for collection_name, problems in report.items():
+            for problem, names in problems.items():
+                if names:
+                    logger.warning(f"Index check: {collection_name} {problem}: {', '.join(names)}")
+
+# =============================================================================
+# PAGINATION
+# =============================================================================
+
+# Lists are ordered newest first by (timestamp, id); a cursor is the last item's pair,
+# so each page is an index seek instead of skipping over everything before it.
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(sort_value: datetime, item_id: str) -> str:
+    raw = json.dumps([sort_value.isoformat(), item_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_text, item_id = json.loads(raw)
+        return datetime.fromisoformat(sort_text), str(item_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_query(query: Dict[str, Any], field: str, cursor: Optional[str]) -> Dict[str, Any]:
+    """Restrict ``query`` to items strictly after ``cursor`` in (field, id) descending order"""
+    if not cursor:
+        return query
+    sort_value, item_id = decode_cursor(cursor)
+    return {
+        **query,
+        "$or": [
+            {field: {"$lt": sort_value}},
+            {field: sort_value, "id": {"$lt": item_id}}
+        ]
+    }
+
+async def fetch_page(collection, query: Dict[str, Any], field: str, response: Response,
+                     skip: int, limit: int, cursor: Optional[str], projection: Optional[Dict[str, Any]] = None):
+    """Fetch one page newest first, by cursor when given (``skip`` is kept for old clients)"""
+    find = collection.find(keyset_query(query, field, cursor), projection).sort([(field, -1), ("id", -1)])
+    if not cursor and skip:
+        find = find.skip(skip)
+    documents = await find.limit(limit).to_list(limit)
+    if len(documents) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(documents[-1][field], documents[-1]["id"])
+    return documents
+
+# =============================================================================
+# DOCUMENT CACHE
+# =============================================================================
+
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "2048"))
+# Seconds a cached document is served for; bounds how stale a write made outside the
+# invalidating endpoints (or a lost invalidation from another worker) can be seen
+CACHE_TTLS = {"users": 30.0, "photos": 10.0, "watch_sessions": 5.0}
+CACHE_PROJECTIONS = {"watch_sessions": {"_id": 0, "chat_messages": 0}}
+
+class DocumentCache:
+    """Read-through LRU cache of single documents looked up by ``id``.
+
+    Only collections listed in CACHE_TTLS are cached. Endpoints that change a cached
+    document call ``invalidate``, which is relayed so other workers drop it too.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        # (collection, id) -> (expires at, document)
+        self.entries: "OrderedDict[Tuple[str, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.counters: Dict[str, Dict[str, int]] = {
+            name: {"hits": 0, "misses": 0, "invalidations": 0} for name in CACHE_TTLS
+        }
+        self.evictions = 0
+
+    async def get(self, collection: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the document, or None if it does not exist"""
+        ttl = CACHE_TTLS.get(collection)
+        if ttl is None:
+            return await db[collection].find_one({"id": doc_id}, {"_id": 0})
+        
+        key = (collection, doc_id)
+        entry = self.entries.get(key)
+        now = time.monotonic()
+        if entry is not None and entry[0] > now:
+            self.entries.move_to_end(key)
+            self.counters[collection]["hits"] += 1
+            return dict(entry[1])
+        
+        self.counters[collection]["misses"] += 1
+        document = await db[collection].find_one({"id": doc_id}, CACHE_PROJECTIONS.get(collection, {"_id": 0}))
+        if document is None:
+            self.entries.pop(key, None)
+            return None
+        self.entries[key] = (now + ttl, document)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return dict(document)
+
+    def discard(self, collection: str, doc_id: str):
+        if self.entries.pop((collection, doc_id), None) is not None:
+            self.counters[collection]["invalidations"] += 1
+
+    def discard_relayed(self, payload: Dict[str, Any]):
+        self.discard(payload["collection"], payload["id"])
+
+    async def invalidate(self, collection: str, doc_id: str):
+        """Drop a document after changing it, here and on the other workers"""
+        if collection in CACHE_TTLS:
+            self.discard(collection, doc_id)
+            await manager.relay("cache_invalidate", {"collection": collection, "id": doc_id})
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self.entries), "evictions": self.evictions, "collections": self.counters}
+
+document_cache = DocumentCache(CACHE_MAX_ENTRIES)
+manager.on_relay("cache_invalidate", document_cache.discard_relayed)
+
+# =============================================================================
+# CONDITIONAL REQUESTS
+# =============================================================================
+
+# Counters only stay in step across workers through a backplane that reaches them.
+# "auto" answers 304s only with one (WS_BACKPLANE=unix), "on" also with the in-process
+# backplane (a single worker) and "off" never does.
+CONDITIONAL_GETS = os.environ.get("CONDITIONAL_GETS", "auto")
+
+class ChangeCounters:
+    """A change counter per collection, used as the validator for conditional GETs.
+
+    Every endpoint that changes what a list shows bumps the collection's counter, and
+    the bump is relayed so other workers count it too. ETags carry a random per-process
+    epoch, so a restarted worker starting from zero never repeats an ETag it handed out
+    before, and an ETag from another worker simply does not match. Without a relay a
+    worker would never see another worker's changes, so 304s are then off by default.
+    """
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.epoch = uuid.uuid4().hex[:8]
+        self.counters: Dict[str, int] = {}
+
+    def increment(self, collection: str):
+        self.counters[collection] = self.counters.get(collection, 0) + 1
+
+    def increment_relayed(self, payload: Dict[str, Any]):
+        self.increment(payload["collection"])
+
+    async def bump(self, collection: str):
+        self.increment(collection)
+        await manager.relay("collection_changed", {"collection": collection})
+
+    def etag(self, collection: str, request: Request) -> str:
+        # The query string is part of the validator: each page/filter is its own representation
+        params = hashlib.blake2b(str(request.url.query).encode(), digest_size=6).hexdigest()
+        return f'W/"{self.epoch}-{self.counters.get(collection, 0)}-{params}"'
+
+change_counters = ChangeCounters(
+    CONDITIONAL_GETS == "on" or (CONDITIONAL_GETS == "auto" and WS_BACKPLANE != "memory")
+)
+manager.on_relay("collection_changed", change_counters.increment_relayed)
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in (tag.strip() for tag in header.split(","))
+
+def not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """Return a 304 if the client already has ``etag``; otherwise tag the response being built"""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+def collection_not_modified(request: Request, response: Response, collection: str) -> Optional[Response]:
+    """Conditional GET against a collection's change counter, decided before any query"""
+    if not change_counters.enabled:
+        return None
+    return not_modified(request, response, change_counters.etag(collection, request))
+
+def check_conditional_gets():
+    if WS_BACKPLANE != "memory":
+        return
+    if change_counters.enabled:
+        logger.warning("CONDITIONAL_GETS=on with WS_BACKPLANE=memory: list ETags are only correct with a single worker")
+    elif CONDITIONAL_GETS == "auto":
+        logger.info("Conditional GETs on lists are off: WS_BACKPLANE=memory does not share change counters between workers")
+
+# =============================================================================
+# READ PATH
+# =============================================================================
+
+# Documents read from our own collections were validated when they were written, so by
+# default read routes skip building validated models and FastAPI's second response_model
+# pass: models are constructed without validation and serialized to JSON in one step.
+# READ_PATH sets the default ("trusted" or "validated"); READ_PATH_ROUTES overrides it per
+# route, e.g. "get_photo=validated,get_videos=trusted".
+READ_PATH = os.environ.get("READ_PATH", "trusted")
+READ_PATH_ROUTES = dict(
+    item.split("=", 1) for item in os.environ.get("READ_PATH_ROUTES", "").split(",") if "=" in item
+)
+# Response headers FastAPI would otherwise copy from the injected Response
+FORWARDED_HEADER_SKIP = {"content-length", "content-type"}
+
+class TrustedJSONResponse(Response):
+    media_type = "application/json"
+
+@functools.lru_cache(maxsize=None)
+def list_adapter(model) -> TypeAdapter:
+    return TypeAdapter(List[model])
+
+def forwarded_headers(response: Optional[Response]) -> Dict[str, str]:
+    if response is None:
+        return {}
+    return {key: value for key, value in response.headers.items() if key not in FORWARDED_HEADER_SKIP}
+
+def render_documents(route: str, model, documents: List[Dict[str, Any]], response: Optional[Response] = None):
+    """Turn trusted documents into a list response using the route's read path"""
+    if READ_PATH_ROUTES.get(route, READ_PATH) == "validated":
+        return [model(**document) for document in documents]
+    items = [model.model_construct(**document) for document in documents]
+    return TrustedJSONResponse(content=list_adapter(model).dump_json(items), headers=forwarded_headers(response))
+
+def render_document(route: str, model, document: Dict[str, Any], response: Optional[Response] = None):
+    """Single-document variant of render_documents"""
+    if READ_PATH_ROUTES.get(route, READ_PATH) == "validated":
+        return model(**document)
+    item = model.model_construct(**document)
+    return TrustedJSONResponse(content=item.model_dump_json(), headers=forwarded_headers(response))
+
 # =============================================================================
 # API ENDPOINTS
 # =============================================================================
@@ -208,6 +1234,11 @@ class VideoCallSession(BaseModel):
 async def root():
     return {"message": "Birthday Celebration API", "version": "1.0.0"}
 
+@api_router.get("/cache/stats")
+async def get_cache_stats():
+    """Document cache counters for this worker"""
+    return document_cache.stats()
+
 # =============================================================================
 # USER MANAGEMENT
 # =============================================================================
@@ -227,10 +1258,11 @@ async def create_user(user_data: UserCreate):
 @api_router.get("/users/{user_id}", response_model=User)
 async def get_user(user_id: str):
     """Get user by ID"""
-    user = await db.users.find_one({"id": user_id})
+    user = await document_cache.get("users", user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return User(**user)
+    # Presence is live; the cached flag may be behind
+    return User(**{**user, "is_online": presence.is_online(user_id)})
 
 @api_router.put("/users/{user_id}", response_model=User)
 async def update_user(user_id: str, user_data: UserUpdate):
@@ -245,6 +1277,7 @@ async def update_user(user_id: str, user_data: UserUpdate):
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
+    await document_cache.invalidate("users", user_id)
     
     updated_user = await db.users.find_one({"id": user_id})
     return User(**updated_user)
@@ -252,21 +1285,90 @@ async def update_user(user_id: str, user_data: UserUpdate):
 @api_router.get("/users", response_model=List[User])
 async def get_online_users():
     """Get all online users"""
-    users = await db.users.find({"is_online": True}).to_list(100)
-    return [User(**user) for user in users]
+    online = presence.online_users()
+    if not online:
+        return []
+    users = await db.users.find({"id": {"$in": list(online)}}).to_list(len(online))
+    # The presence registry is authoritative; the stored flag is only flushed periodically
+    return [User(**{**user, "is_online": True}) for user in users]
 
 # =============================================================================
 # PHOTO GALLERY
 # =============================================================================
 
+RECENT_COMMENTS = 3
+
+# Projection for gallery lists: counts are computed server-side so the
+# likes/comments arrays and the base64 payloads never leave Mongo
+MEDIA_SUMMARY_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "user_id": 1,
+    "title": 1,
+    "description": 1,
+    "file_size": 1,
+    "mime_type": 1,
+    "uploaded_at": 1,
+    "like_count": {"$ifNull": ["$like_count", {"$size": {"$ifNull": ["$likes", []]}}]},
+    "comment_count": {"$ifNull": ["$comment_count", {"$size": {"$ifNull": ["$comments", []]}}]},
+    "has_thumbnail": {"$or": [
+        {"$ifNull": ["$thumbnails.small", False]},
+        {"$ifNull": ["$thumbnail_data", False]}
+    ]},
+}
+PHOTO_SUMMARY_PROJECTION = {**MEDIA_SUMMARY_PROJECTION, "is_featured": 1}
+VIDEO_SUMMARY_PROJECTION = {**MEDIA_SUMMARY_PROJECTION, "duration": 1, "views": 1}
+
+def media_summary(kind: str, document: Dict[str, Any]) -> Dict[str, Any]:
+    """Complete a projected list document with the per-item media URLs"""
+    base = f"/api/{kind}/{document['id']}"
+    has_thumbnail = document.pop("has_thumbnail", False)
+    document["content_url"] = f"{base}/content"
+    document["thumbnail_url"] = f"{base}/thumbnail" if has_thumbnail else None
+    return document
+
+def media_response(document: Dict[str, Any], legacy_field: str) -> Response:
+    """Serve a media document's content from the blob store, or decode its legacy base64 field"""
+    if document.get("blob_key"):
+        path = blob_store.path_for(document["blob_key"])
+        if not path.exists():
+            raise HTTPException(status_code=404, detail="Media content missing")
+        return FileResponse(path, media_type=document["mime_type"])
+    if document.get(legacy_field):
+        return Response(content=base64.b64decode(document[legacy_field]), media_type=document["mime_type"])
+    raise HTTPException(status_code=404, detail="Media content missing")
+
 @api_router.post("/photos", response_model=Photo)
-async def upload_photo(user_id: str = Form(...), photo_data: PhotoCreate = Form(...)):
+async def upload_photo(
+    user_id: str = Form(...),
+    title: str = Form(...),
+    description: Optional[str] = Form(None),
+    file: UploadFile = File(...)
+):
     """Upload a new photo"""
-    photo = Photo(user_id=user_id, **photo_data.dict())
-    await db.photos.insert_one(photo.dict())
+    if not (file.content_type or "").startswith("image/"):
+        raise HTTPException(status_code=400, detail="File must be an image")
     
-    # Broadcast new photo notification
-    await manager.broadcast({
+    photo_data = PhotoCreate(title=title, description=description)
+    blob = await blob_store.save_upload(file, MAX_PHOTO_BYTES)
+    photo = Photo(
+        user_id=user_id,
+        blob_key=blob.key,
+        checksum=blob.checksum,
+        file_size=blob.size,
+        mime_type=blob.mime_type,
+        **photo_data.dict()
+    )
+    try:
+        await db.photos.insert_one(photo.dict())
+    except Exception:
+        await blob_store.delete(blob.key)
+        raise
+    await change_counters.bump("photos")
+    schedule_thumbnails("photos", photo.id, blob.key)
+    
+    # Notify gallery subscribers
+    await manager.publish("gallery", {
         "type": "new_photo",
         "photo_id": photo.id,
         "user_id": user_id,
@@ -275,20 +1377,40 @@ async def upload_photo(user_id: str = Form(...), photo_data: PhotoCreate = Form(
     
     return photo
 
-@api_router.get("/photos", response_model=List[Photo])
-async def get_photos(skip: int = 0, limit: int = 20, featured_only: bool = False):
-    """Get photos with pagination"""
+@api_router.get("/photos", response_model=List[PhotoSummary])
+async def get_photos(request: Request, response: Response, skip: int = 0, limit: int = 20,
+                     featured_only: bool = False, cursor: Optional[str] = None):
+    """Get photo metadata with pagination; follow the X-Next-Cursor header for the next page"""
+    unchanged = collection_not_modified(request, response, "photos")
+    if unchanged:
+        return unchanged
     query = {"is_featured": True} if featured_only else {}
-    photos = await db.photos.find(query).sort("uploaded_at", -1).skip(skip).limit(limit).to_list(limit)
-    return [Photo(**photo) for photo in photos]
+    photos = await fetch_page(db.photos, query, "uploaded_at", response, skip, limit, cursor, PHOTO_SUMMARY_PROJECTION)
+    return render_documents("get_photos", PhotoSummary, [media_summary("photos", photo) for photo in photos], response)
 
 @api_router.get("/photos/{photo_id}", response_model=Photo)
-async def get_photo(photo_id: str):
+async def get_photo(photo_id: str, request: Request, response: Response):
     """Get a specific photo"""
-    photo = await db.photos.find_one({"id": photo_id})
+    unchanged = collection_not_modified(request, response, "photos")
+    if unchanged:
+        return unchanged
+    photo = await document_cache.get("photos", photo_id)
+    if not photo:
+        raise HTTPException(status_code=404, detail="Photo not found")
+    return render_document("get_photo", Photo, photo, response)
+
+@api_router.get("/photos/{photo_id}/content")
+async def get_photo_content(photo_id: str):
+    """Get the raw image bytes of a photo"""
+    photo = await db.photos.find_one({"id": photo_id}, {"blob_key": 1, "image_data": 1, "mime_type": 1})
     if not photo:
         raise HTTPException(status_code=404, detail="Photo not found")
-    return Photo(**photo)
+    return media_response(photo, "image_data")
+
+@api_router.get("/photos/{photo_id}/thumbnail")
+async def get_photo_thumbnail(photo_id: str, size: str = DEFAULT_THUMBNAIL_SIZE):
+    """Get a photo thumbnail (small, medium or large)"""
+    return await thumbnail_response("photos", photo_id, size)
 
 @api_router.put("/photos/{photo_id}", response_model=Photo)
 async def update_photo(photo_id: str, photo_data: PhotoUpdate):
@@ -302,6 +1424,8 @@ async def update_photo(photo_id: str, photo_data: PhotoUpdate):
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Photo not found")
+    await document_cache.invalidate("photos", photo_id)
+    await change_counters.bump("photos")
     
     updated_photo = await db.photos.find_one({"id": photo_id})
     return Photo(**updated_photo)
@@ -309,54 +1433,257 @@ async def update_photo(photo_id: str, photo_data: PhotoUpdate):
 @api_router.post("/photos/{photo_id}/like")
 async def like_photo(photo_id: str, user_id: str):
     """Like or unlike a photo"""
-    photo = await db.photos.find_one({"id": photo_id})
-    if not photo:
-        raise HTTPException(status_code=404, detail="Photo not found")
-    
-    likes = photo.get("likes", [])
-    if user_id in likes:
-        likes.remove(user_id)
-        action = "unliked"
-    else:
-        likes.append(user_id)
-        action = "liked"
-    
-    await db.photos.update_one(
-        {"id": photo_id},
-        {"$set": {"likes": likes}}
-    )
-    
-    return {"status": action, "total_likes": len(likes)}
+    return await toggle_like("photos", photo_id, user_id)
 
 @api_router.post("/photos/{photo_id}/comment")
 async def add_photo_comment(photo_id: str, user_id: str, comment: str):
     """Add a comment to a photo"""
-    comment_data = {
-        "id": str(uuid.uuid4()),
-        "user_id": user_id,
-        "comment": comment,
-        "created_at": datetime.utcnow().isoformat()
-    }
+    comment_data = PhotoComment(photo_id=photo_id, user_id=user_id, comment=comment)
+    await db.photo_comments.insert_one(comment_data.dict())
     
-    await db.photos.update_one(
+    # Keep only a count and a short preview on the photo itself
+    result = await db.photos.update_one(
         {"id": photo_id},
-        {"$push": {"comments": comment_data}}
+        {
+            "$inc": {"comment_count": 1},
+            "$push": {"recent_comments": {"$each": [comment_data.dict()], "$slice": -RECENT_COMMENTS}}
+        }
     )
+    if result.matched_count == 0:
+        await db.photo_comments.delete_one({"id": comment_data.id})
+        raise HTTPException(status_code=404, detail="Photo not found")
+    await document_cache.invalidate("photos", photo_id)
+    await change_counters.bump("photos")
     
     return {"status": "success", "comment": comment_data}
 
+@api_router.get("/photos/{photo_id}/comments", response_model=List[PhotoComment])
+async def get_photo_comments(photo_id: str, response: Response, limit: int = 20, cursor: Optional[str] = None):
+    """Get a photo's comments, newest first; follow the X-Next-Cursor header for older ones"""
+    comments = await fetch_page(
+        db.photo_comments, {"photo_id": photo_id}, "created_at", response, 0, limit, cursor, {"_id": 0}
+    )
+    return render_documents("get_photo_comments", PhotoComment, comments, response)
+
+async def migrate_embedded_comments():
+    """Move comments still embedded in photo documents into photo_comments"""
+    async for photo in db.photos.find({"comments.0": {"$exists": True}}, {"id": 1, "comments": 1}):
+        comments = [
+            PhotoComment(
+                photo_id=photo["id"],
+                user_id=comment["user_id"],
+                comment=comment["comment"],
+                created_at=comment["created_at"],
+                **({"id": comment["id"]} if comment.get("id") else {})
+            ).dict()
+            for comment in photo["comments"]
+        ]
+        comments.sort(key=lambda comment: comment["created_at"])
+        recent = [dict(comment) for comment in comments[-RECENT_COMMENTS:]]
+        # Duplicates were copied by an interrupted earlier run; anything else keeps the
+        # embedded comments in place so the next startup retries this photo
+        if await insert_write_behind(db.photo_comments, comments):
+            logger.warning(f"Keeping embedded comments on photo {photo['id']} until they are copied")
+            continue
+        await db.photos.update_one(
+            {"id": photo["id"]},
+            {
+                "$set": {"comment_count": len(comments), "recent_comments": recent},
+                "$unset": {"comments": ""}
+            }
+        )
+
 # =============================================================================
 # VIDEO GALLERY
 # =============================================================================
 
+STREAM_CHUNK_SIZE = 256 * 1024
+VIEW_SESSION_TTL = 30 * 60  # seconds a playback session is remembered for view counting
+
+# (video_id, playback session) -> monotonic time the view was counted
+recent_views: Dict[Tuple[str, str], float] = {}
+
+def parse_byte_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single ``bytes=start-end`` range into inclusive offsets.
+
+    Returns None for ranges that cannot be satisfied and raises ValueError for
+    headers we do not handle (multiple ranges, other units), which are ignored.
+    """
+    units, _, spec = header.partition("=")
+    if units.strip().lower() != "bytes" or "," in spec:
+        raise ValueError("Unsupported range")
+    start_text, dash, end_text = spec.strip().partition("-")
+    if not dash or not (start_text or end_text):
+        raise ValueError("Malformed range")
+    # int() would also take signs, e.g. "--5" as a suffix of -5 bytes
+    if not all(text.isdigit() for text in (start_text, end_text) if text):
+        raise ValueError("Malformed range")
+    if not start_text:
+        suffix = int(end_text)
+        if suffix == 0 or size == 0:
+            return None
+        return max(size - suffix, 0), size - 1
+    start = int(start_text)
+    end = min(int(end_text), size - 1) if end_text else size - 1
+    if start >= size or start > end:
+        return None
+    return start, end
+
+async def iter_file_range(path: Path, start: int, end: int):
+    """Yield ``path[start:end + 1]`` in chunks using positional reads off the event loop"""
+    fd = await asyncio.to_thread(os.open, path, os.O_RDONLY)
+    try:
+        offset = start
+        while offset <= end:
+            chunk = await asyncio.to_thread(os.pread, fd, min(STREAM_CHUNK_SIZE, end - offset + 1), offset)
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
+    finally:
+        os.close(fd)
+
+async def ranged_media_response(request: Request, document: Dict[str, Any], legacy_field: str) -> Tuple[Response, int]:
+    """Serve media with Range/ETag support; returns the response and the first byte offset served"""
+    if document.get("blob_key"):
+        path = blob_store.path_for(document["blob_key"])
+        try:
+            size = (await asyncio.to_thread(path.stat)).st_size
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Media content missing")
+        content = None
+    elif document.get(legacy_field):
+        path = None
+        content = base64.b64decode(document[legacy_field])
+        size = len(content)
+    else:
+        raise HTTPException(status_code=404, detail="Media content missing")
+    
+    etag = f'"{document.get("checksum") or document["id"]}-{size}"'
+    headers = {"Accept-Ranges": "bytes", "ETag": etag}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers), 0
+    
+    byte_range = None
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", etag) == etag:
+        try:
+            byte_range = parse_byte_range(range_header, size)
+            if byte_range is None:
+                return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"}), 0
+        except ValueError:
+            byte_range = None  # Unsupported or malformed: fall back to the full body
+    
+    if byte_range is None:
+        if path is not None:
+            # Whole file: let the server use sendfile where it supports it
+            return FileResponse(path, media_type=document["mime_type"], headers=headers), 0
+        return Response(content=content, media_type=document["mime_type"], headers=headers), 0
+    
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    if path is not None:
+        body = iter_file_range(path, start, end)
+        return StreamingResponse(body, status_code=206, media_type=document["mime_type"], headers=headers), start
+    return Response(content=content[start:end + 1], status_code=206, media_type=document["mime_type"], headers=headers), start
+
+def should_count_view(video_id: str, playback_id: str) -> bool:
+    """Count a view once per playback session, however many range requests it makes"""
+    now = time.monotonic()
+    if len(recent_views) > 10000:
+        for key, seen_at in list(recent_views.items()):
+            if now - seen_at > VIEW_SESSION_TTL:
+                del recent_views[key]
+    key = (video_id, playback_id)
+    seen_at = recent_views.get(key)
+    if seen_at is not None and now - seen_at < VIEW_SESSION_TTL:
+        return False
+    recent_views[key] = now
+    return True
+
+VIEW_FLUSH_INTERVAL = float(os.environ.get("VIEW_FLUSH_INTERVAL", "5"))
+
+class ViewCounter:
+    """Video views aggregated in memory and written with one bulk_write per interval.
+
+    Reads add the pending increments to the stored ``views`` so a count never goes
+    backwards between flushes. Views pending on other workers show up once flushed.
+    """
+
+    def __init__(self):
+        self.pending: Dict[str, int] = {}
+
+    def add(self, video_id: str):
+        self.pending[video_id] = self.pending.get(video_id, 0) + 1
+        # This worker's reads change right away; other workers are told at flush time
+        change_counters.increment("videos")
+
+    def overlay(self, video: Dict[str, Any]) -> Dict[str, Any]:
+        pending = self.pending.get(video["id"])
+        if pending:
+            video["views"] = video.get("views", 0) + pending
+        return video
+
+    async def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        video_ids = list(batch)
+        try:
+            await db.videos.bulk_write(
+                [UpdateOne({"id": video_id}, {"$inc": {"views": batch[video_id]}}) for video_id in video_ids],
+                ordered=False
+            )
+        except BulkWriteError as e:
+            failed = [video_ids[error["index"]] for error in e.details.get("writeErrors", [])]
+            logger.warning(f"View count flush failed for {len(failed)} videos")
+            self._restore({video_id: batch[video_id] for video_id in failed})
+        except Exception as e:
+            logger.warning(f"View count flush failed: {e}")
+            self._restore(batch)
+            return
+        await change_counters.bump("videos")
+
+    def _restore(self, batch: Dict[str, int]):
+        for video_id, count in batch.items():
+            self.pending[video_id] = self.pending.get(video_id, 0) + count
+
+view_counter = ViewCounter()
+run_periodically("video_views", VIEW_FLUSH_INTERVAL, view_counter.flush)
+
 @api_router.post("/videos", response_model=Video)
-async def upload_video(user_id: str = Form(...), video_data: VideoCreate = Form(...)):
+async def upload_video(
+    user_id: str = Form(...),
+    title: str = Form(...),
+    description: Optional[str] = Form(None),
+    duration: Optional[int] = Form(None),
+    file: UploadFile = File(...)
+):
     """Upload a new video"""
-    video = Video(user_id=user_id, **video_data.dict())
-    await db.videos.insert_one(video.dict())
+    if not (file.content_type or "").startswith("video/"):
+        raise HTTPException(status_code=400, detail="File must be a video")
     
-    # Broadcast new video notification
-    await manager.broadcast({
+    video_data = VideoCreate(title=title, description=description, duration=duration)
+    blob = await blob_store.save_upload(file, MAX_VIDEO_BYTES)
+    video = Video(
+        user_id=user_id,
+        blob_key=blob.key,
+        checksum=blob.checksum,
+        file_size=blob.size,
+        mime_type=blob.mime_type,
+        **video_data.dict()
+    )
+    try:
+        await db.videos.insert_one(video.dict())
+    except Exception:
+        await blob_store.delete(blob.key)
+        raise
+    await change_counters.bump("videos")
+    schedule_thumbnails("videos", video.id, blob.key)
+    
+    # Notify gallery subscribers
+    await manager.publish("gallery", {
         "type": "new_video",
         "video_id": video.id,
         "user_id": user_id,
@@ -365,48 +1692,69 @@ async def upload_video(user_id: str = Form(...), video_data: VideoCreate = Form(
     
     return video
 
-@api_router.get("/videos", response_model=List[Video])
-async def get_videos(skip: int = 0, limit: int = 20):
-    """Get videos with pagination"""
-    videos = await db.videos.find({}).sort("uploaded_at", -1).skip(skip).limit(limit).to_list(limit)
-    return [Video(**video) for video in videos]
+@api_router.get("/videos", response_model=List[VideoSummary])
+async def get_videos(request: Request, response: Response, skip: int = 0, limit: int = 20,
+                     cursor: Optional[str] = None):
+    """Get video metadata with pagination; follow the X-Next-Cursor header for the next page"""
+    unchanged = collection_not_modified(request, response, "videos")
+    if unchanged:
+        return unchanged
+    videos = await fetch_page(db.videos, {}, "uploaded_at", response, skip, limit, cursor, VIDEO_SUMMARY_PROJECTION)
+    summaries = [view_counter.overlay(media_summary("videos", video)) for video in videos]
+    return render_documents("get_videos", VideoSummary, summaries, response)
 
 @api_router.get("/videos/{video_id}", response_model=Video)
-async def get_video(video_id: str):
+async def get_video(video_id: str, request: Request, response: Response):
     """Get a specific video"""
-    video = await db.videos.find_one({"id": video_id})
+    unchanged = collection_not_modified(request, response, "videos")
+    if unchanged:
+        return unchanged
+    video = await db.videos.find_one({"id": video_id}, {"_id": 0})
     if not video:
         raise HTTPException(status_code=404, detail="Video not found")
-    
-    # Increment view count
-    await db.videos.update_one(
+    return render_document("get_video", Video, view_counter.overlay(video), response)
+
+@api_router.get("/videos/{video_id}/stream")
+async def stream_video(video_id: str, request: Request, playback: Optional[str] = None):
+    """Stream video bytes with HTTP Range support, counting one view per playback session"""
+    video = await db.videos.find_one(
         {"id": video_id},
-        {"$inc": {"views": 1}}
+        {"id": 1, "blob_key": 1, "checksum": 1, "video_data": 1, "mime_type": 1}
     )
-    
-    return Video(**video)
-
-@api_router.post("/videos/{video_id}/like")
-async def like_video(video_id: str, user_id: str):
-    """Like or unlike a video"""
-    video = await db.videos.find_one({"id": video_id})
     if not video:
         raise HTTPException(status_code=404, detail="Video not found")
     
-    likes = video.get("likes", [])
-    if user_id in likes:
-        likes.remove(user_id)
-        action = "unliked"
-    else:
-        likes.append(user_id)
-        action = "liked"
+    response, start = await ranged_media_response(request, video, "video_data")
     
-    await db.videos.update_one(
+    if start == 0 and response.status_code in (200, 206):
+        client_host = request.client.host if request.client else ""
+        playback_id = playback or f"{client_host}|{request.headers.get('user-agent', '')}"
+        if should_count_view(video_id, playback_id):
+            view_counter.add(video_id)
+    
+    return response
+
+@api_router.get("/videos/{video_id}/content")
+async def get_video_content(video_id: str, request: Request):
+    """Get the raw bytes of a video (range requests supported, no view counting)"""
+    video = await db.videos.find_one(
         {"id": video_id},
-        {"$set": {"likes": likes}}
+        {"id": 1, "blob_key": 1, "checksum": 1, "video_data": 1, "mime_type": 1}
     )
-    
-    return {"status": action, "total_likes": len(likes)}
+    if not video:
+        raise HTTPException(status_code=404, detail="Video not found")
+    response, _ = await ranged_media_response(request, video, "video_data")
+    return response
+
+@api_router.get("/videos/{video_id}/thumbnail")
+async def get_video_thumbnail(video_id: str, size: str = DEFAULT_THUMBNAIL_SIZE):
+    """Get a video thumbnail (small, medium, large or the full-size poster frame)"""
+    return await thumbnail_response("videos", video_id, size, legacy_mime_type="image/jpeg")
+
+@api_router.post("/videos/{video_id}/like")
+async def like_video(video_id: str, user_id: str):
+    """Like or unlike a video"""
+    return await toggle_like("videos", video_id, user_id)
 
 # =============================================================================
 # BIRTHDAY WISHES
@@ -416,7 +1764,7 @@ async def like_video(video_id: str, user_id: str):
 async def create_birthday_wish(user_id: str, wish_data: BirthdayWishCreate):
     """Create a new birthday wish"""
     # Get user info
-    user = await db.users.find_one({"id": user_id})
+    user = await document_cache.get("users", user_id)
     user_name = user["display_name"] if user else "Anonymous"
     
     wish = BirthdayWish(
@@ -425,9 +1773,10 @@ async def create_birthday_wish(user_id: str, wish_data: BirthdayWishCreate):
         **wish_data.dict()
     )
     await db.birthday_wishes.insert_one(wish.dict())
+    await change_counters.bump("birthday_wishes")
     
-    # Broadcast new wish notification
-    await manager.broadcast({
+    # Notify wishes subscribers
+    await manager.publish("wishes", {
         "type": "new_wish",
         "wish_id": wish.id,
         "user_name": user_name,
@@ -437,40 +1786,355 @@ async def create_birthday_wish(user_id: str, wish_data: BirthdayWishCreate):
     return wish
 
 @api_router.get("/wishes", response_model=List[BirthdayWish])
-async def get_birthday_wishes(skip: int = 0, limit: int = 50):
-    """Get birthday wishes"""
-    wishes = await db.birthday_wishes.find({"is_approved": True}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    return [BirthdayWish(**wish) for wish in wishes]
+async def get_birthday_wishes(request: Request, response: Response, skip: int = 0, limit: int = 50,
+                              cursor: Optional[str] = None):
+    """Get birthday wishes; follow the X-Next-Cursor header for the next page"""
+    unchanged = collection_not_modified(request, response, "birthday_wishes")
+    if unchanged:
+        return unchanged
+    wishes = await fetch_page(
+        db.birthday_wishes, {"is_approved": True}, "created_at", response, skip, limit, cursor, {"_id": 0}
+    )
+    return render_documents("get_birthday_wishes", BirthdayWish, wishes, response)
 
 @api_router.post("/wishes/{wish_id}/like")
 async def like_wish(wish_id: str, user_id: str):
     """Like or unlike a birthday wish"""
-    wish = await db.birthday_wishes.find_one({"id": wish_id})
-    if not wish:
-        raise HTTPException(status_code=404, detail="Wish not found")
-    
-    likes = wish.get("likes", [])
-    if user_id in likes:
-        likes.remove(user_id)
-        action = "unliked"
-    else:
-        likes.append(user_id)
-        action = "liked"
-    
-    await db.birthday_wishes.update_one(
-        {"id": wish_id},
-        {"$set": {"likes": likes}}
+    return await toggle_like("wishes", wish_id, user_id)
+
+# =============================================================================
+# REACTIONS
+# =============================================================================
+
+# kind -> (collection name, 404 detail)
+REACTION_TARGETS = {
+    "photos": ("photos", "Photo not found"),
+    "videos": ("videos", "Video not found"),
+    "wishes": ("birthday_wishes", "Wish not found"),
+}
+MAX_LIKED_LOOKUP = 200
+
+class LikedLookup(BaseModel):
+    kind: str  # "photos", "videos" or "wishes"
+    user_id: str
+    ids: List[str]
+
+def reaction_collection(kind: str):
+    if kind not in REACTION_TARGETS:
+        raise HTTPException(status_code=400, detail=f"Unknown reaction target: {kind}")
+    return db[REACTION_TARGETS[kind][0]]
+
+async def toggle_like(kind: str, item_id: str, user_id: str) -> Dict[str, Any]:
+    """Like or unlike an item in one round trip.
+
+    A single pipeline update checks membership and flips both the likes set and the
+    denormalized like_count, so racing requests can never double count.
+    """
+    collection = reaction_collection(kind)
+    likes = {"$ifNull": ["$likes", []]}
+    already_liked = {"$in": [user_id, likes]}
+    item = await collection.find_one_and_update(
+        {"id": item_id},
+        [{"$set": {
+            # Both expressions see the document as it was before this update
+            "likes": {"$cond": [
+                already_liked,
+                {"$filter": {"input": likes, "cond": {"$ne": ["$$this", user_id]}}},
+                {"$concatArrays": [likes, [user_id]]}
+            ]},
+            "like_count": {"$add": [{"$ifNull": ["$like_count", 0]}, {"$cond": [already_liked, -1, 1]}]}
+        }}],
+        projection={"_id": 0, "like_count": 1, "likes": {"$elemMatch": {"$eq": user_id}}},
+        return_document=ReturnDocument.AFTER
     )
-    
-    return {"status": action, "total_likes": len(likes)}
+    if item is None:
+        raise HTTPException(status_code=404, detail=REACTION_TARGETS[kind][1])
+    await document_cache.invalidate(collection.name, item_id)
+    await change_counters.bump(collection.name)
+    status = "liked" if item.get("likes") else "unliked"
+    return {"status": status, "total_likes": item["like_count"]}
+
+@api_router.post("/reactions/liked")
+async def get_liked_items(lookup: LikedLookup):
+    """Return which of the given items the user has liked, in one query"""
+    if len(lookup.ids) > MAX_LIKED_LOOKUP:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_LIKED_LOOKUP} ids per lookup")
+    collection = reaction_collection(lookup.kind)
+    liked = await collection.find(
+        {"id": {"$in": lookup.ids}, "likes": lookup.user_id},
+        {"_id": 0, "id": 1}
+    ).to_list(len(lookup.ids))
+    return {"liked": [item["id"] for item in liked]}
+
+async def backfill_like_counts():
+    """Give documents written before like_count existed a count matching their likes array"""
+    for collection_name, _ in REACTION_TARGETS.values():
+        await db[collection_name].update_many(
+            {"like_count": {"$exists": False}},
+            [{"$set": {"like_count": {"$size": {"$ifNull": ["$likes", []]}}}}]
+        )
 
 # =============================================================================
 # GAMES SYSTEM
 # =============================================================================
 
+GAME_MOVE_LOG_INTERVAL = float(os.environ.get("GAME_MOVE_LOG_INTERVAL", "0.5"))
+GAME_SNAPSHOT_INTERVAL = float(os.environ.get("GAME_SNAPSHOT_INTERVAL", "5"))
+GAME_IDLE_SECONDS = 1800
+GAME_STATE_HISTORY = int(os.environ.get("GAME_STATE_HISTORY", "64"))
+# "through" logs each move before acknowledging it, so several workers can serve the
+# same game. "behind" batches the move log and is only safe with a single worker: two
+# workers could acknowledge different moves for the same seq and one would be lost.
+GAME_MOVE_WRITES = os.environ.get("GAME_MOVE_WRITES", "through")
+GAME_CAS_RETRIES = 5
+GAME_MOVE_IDS_KEPT = 256
+
+class GameConflict(Exception):
+    """Another worker changed the game since it was loaded; reload and retry"""
+
+def diff_game_state(previous: Dict[str, Any], current: Dict[str, Any]) -> Dict[str, Any]:
+    """Top-level keys of the encoded state that changed; merging them into previous gives current"""
+    return {key: value for key, value in current.items() if previous.get(key) != value}
+
+def public_session(session: Dict[str, Any]) -> Dict[str, Any]:
+    """The session as clients may see it, without its rules' private state keys"""
+    rules = GAME_RULES.get(session.get("game_type"))
+    if rules is None or not rules.private_keys:
+        return session
+    return {**session, "game_state": rules.public(session["game_state"])}
+
+class ActiveGame:
+    """A game session held in memory while it is being played"""
+
+    __slots__ = ("session", "rules", "state", "history", "move_ids", "lock", "dirty", "last_used")
+
+    def __init__(self, session: Dict[str, Any]):
+        self.session = session
+        self.rules = get_game_rules(session["game_type"])
+        self.state = self.rules.decode(session["game_state"])
+        # Recent encoded states by seq, for clients resyncing after a missed update
+        self.history: deque = deque(maxlen=GAME_STATE_HISTORY)
+        self.remember()
+        self.move_ids: OrderedDict = OrderedDict()
+        self.lock = asyncio.Lock()
+        self.dirty = False
+        self.last_used = time.monotonic()
+
+    def public_state(self) -> Dict[str, Any]:
+        return self.rules.public(self.session["game_state"])
+
+    def remember(self):
+        # Only ever served to clients, so kept without private keys
+        self.history.append((self.session.get("seq", 0), self.public_state()))
+
+    def remember_move_id(self, move_id: Optional[str], seq: int):
+        if move_id:
+            self.move_ids[move_id] = seq
+            if len(self.move_ids) > GAME_MOVE_IDS_KEPT:
+                self.move_ids.popitem(last=False)
+
+    def state_at(self, seq: int) -> Optional[Dict[str, Any]]:
+        for entry_seq, game_state in reversed(self.history):
+            if entry_seq == seq:
+                return game_state
+            if entry_seq < seq:
+                break
+        return None
+
+class GameEngine:
+    """Runs moves against in-memory game state.
+
+    Moves on one game are serialized by its lock and written to ``game_moves`` before
+    they are acknowledged (with GAME_MOVE_WRITES=behind, on a single worker, they are
+    batched and flushed every GAME_MOVE_LOG_INTERVAL instead). Game state is
+    snapshotted to ``game_sessions`` every GAME_SNAPSHOT_INTERVAL and as soon as a game
+    completes. A game loaded from Mongo replays logged moves newer than its snapshot.
+
+    Writes are compare-and-set: session writes are conditional on ``version`` and the
+    move log is unique on (game_id, seq). A worker whose copy is stale gets a
+    GameConflict, drops the copy and reloads, so a game stays consistent when more
+    than one worker serves it.
+    """
+
+    def __init__(self):
+        self.games: Dict[str, ActiveGame] = {}
+        self.pending_moves: List[Dict[str, Any]] = []
+
+    def add(self, session: Dict[str, Any]) -> ActiveGame:
+        game = ActiveGame(session)
+        self.games[session["id"]] = game
+        return game
+
+    def evict(self, game: ActiveGame):
+        """Forget a game so the next request reloads it from Mongo"""
+        if self.games.get(game.session["id"]) is game:
+            del self.games[game.session["id"]]
+
+    async def get(self, game_id: str) -> Optional[ActiveGame]:
+        game = self.games.get(game_id)
+        if game is None:
+            session = await db.game_sessions.find_one({"id": game_id}, {"_id": 0})
+            if not session:
+                return None
+            rules = GAME_RULES.get(session["game_type"])
+            if rules is None or rules.is_legacy(session["game_state"]):
+                # Left over from before the rules registry; see upgrade_legacy_games
+                raise HTTPException(status_code=410, detail="This game can no longer be played")
+            loaded = ActiveGame(session)
+            await self._replay(loaded)
+            game = self.games.setdefault(game_id, loaded)
+        game.last_used = time.monotonic()
+        return game
+
+    @asynccontextmanager
+    async def locked(self, game_id: str):
+        """Yield the game with its lock held (or None if it does not exist)"""
+        while True:
+            game = await self.get(game_id)
+            if game is None:
+                yield None
+                return
+            await game.lock.acquire()
+            # The game may have been evicted while we waited for the lock
+            if self.games.get(game_id) is game:
+                break
+            game.lock.release()
+        try:
+            yield game
+        finally:
+            game.lock.release()
+
+    async def _replay(self, game: ActiveGame):
+        """Re-apply moves logged after the last state snapshot, e.g. after a restart"""
+        session = game.session
+        moves = db.game_moves.find({"game_id": session["id"], "seq": {"$gt": session.get("seq", 0)}}).sort("seq", 1)
+        async for entry in moves:
+            state, changes = self._apply(game, entry["player_id"], entry["move_data"])
+            self._commit(game, state, changes, entry["seq"])
+            game.remember_move_id(entry.get("move_id"), entry["seq"])
+
+    def _apply(self, game: ActiveGame, player_id: str, move_data: Dict[str, Any]) -> Tuple[Any, Dict[str, Any]]:
+        """Run a move against a copy of the state; returns the new state and session changes"""
+        session = game.session
+        state = game.rules.decode(session["game_state"])
+        status, winner = game.rules.apply_move(state, session["players"], player_id, move_data)
+        # A fresh encoding per move, so published and persisted copies are never mutated
+        changes = {"game_state": state.to_wire(), "status": status, "updated_at": datetime.utcnow()}
+        if winner:
+            changes["winner"] = winner
+        return state, changes
+
+    def _commit(self, game: ActiveGame, state, changes: Dict[str, Any], seq: int):
+        game.state = state
+        game.session.update(changes, seq=seq)
+        game.remember()
+
+    async def move(self, game: ActiveGame, player_id: str, move_data: Dict[str, Any], move_id: Optional[str] = None):
+        """Apply a move; the caller must hold the game's lock.
+
+        Raises InvalidMove if the rules reject it, and GameConflict, evicting the game,
+        if another worker logged a move first. The game only changes once the move is
+        logged (or queued to be), so a failed move never reaches a snapshot.
+        """
+        session = game.session
+        if session["status"] != "active":
+            raise InvalidMove("Game is not active")
+        state, changes = self._apply(game, player_id, move_data)
+        seq = session.get("seq", 0) + 1
+        entry = {
+            "game_id": session["id"],
+            "seq": seq,
+            "player_id": player_id,
+            "move_data": move_data,
+            "created_at": datetime.utcnow()
+        }
+        if move_id:
+            entry["move_id"] = move_id
+        
+        if GAME_MOVE_WRITES == "through":
+            try:
+                await db.game_moves.insert_one(entry)
+            except DuplicateKeyError:
+                self.evict(game)
+                raise GameConflict(session["id"])
+        else:
+            self.pending_moves.append(entry)
+        
+        self._commit(game, state, changes, seq)
+        game.remember_move_id(move_id, seq)
+        game.dirty = True
+        
+        if session["status"] == "completed":
+            await self.flush_moves()
+            await self.snapshot(game)
+
+    async def flush_moves(self):
+        if not self.pending_moves:
+            return
+        batch, self.pending_moves = self.pending_moves, []
+        self.pending_moves = await insert_write_behind(db.game_moves, batch) + self.pending_moves
+
+    async def write_session(self, game: ActiveGame, changes: Dict[str, Any]) -> bool:
+        """Set fields on the session document if nobody wrote it since our last write"""
+        session = game.session
+        version = session.get("version", 0)
+        result = await db.game_sessions.update_one(
+            {"id": session["id"], "version": version},
+            {"$set": changes, "$inc": {"version": 1}}
+        )
+        if not result.matched_count:
+            return False
+        session.update(changes)
+        session["version"] = version + 1
+        return True
+
+    async def snapshot(self, game: ActiveGame):
+        """Write the game's state to its session document; the caller must hold the game's lock"""
+        if not game.dirty:
+            return
+        game.dirty = False
+        session = game.session
+        try:
+            written = await self.write_session(game, {
+                "game_state": session["game_state"],
+                "status": session["status"],
+                "winner": session.get("winner"),
+                "seq": session["seq"],
+                "updated_at": session["updated_at"]
+            })
+        except Exception:
+            game.dirty = True
+            raise
+        if not written:
+            if any(entry["game_id"] == session["id"] for entry in self.pending_moves):
+                # Our moves are not logged yet; reloading now would lose them
+                game.dirty = True
+            else:
+                # Another worker wrote a newer snapshot; reload from it and the move log
+                self.evict(game)
+
+    async def snapshot_all(self):
+        await self.flush_moves()
+        now = time.monotonic()
+        for game_id, game in list(self.games.items()):
+            # A move in flight may be waiting on its log write; snapshot after it
+            async with game.lock:
+                if self.games.get(game_id) is not game:
+                    continue  # Evicted while we waited
+                await self.snapshot(game)
+            finished = game.session["status"] == "completed" or now - game.last_used > GAME_IDLE_SECONDS
+            if finished and not game.dirty and not game.lock.locked():
+                self.evict(game)
+
+game_engine = GameEngine()
+run_periodically("game_move_log", GAME_MOVE_LOG_INTERVAL, game_engine.flush_moves)
+run_periodically("game_snapshot", GAME_SNAPSHOT_INTERVAL, game_engine.snapshot_all)
+
 @api_router.post("/games/create", response_model=GameSession)
 async def create_game_session(game_type: str, player_id: str):
     """Create a new game session"""
+    if game_type not in GAME_RULES:
+        raise HTTPException(status_code=400, detail=f"Unknown game type: {game_type}")
     game_session = GameSession(
         game_type=game_type,
         players=[player_id],
@@ -478,6 +2142,9 @@ async def create_game_session(game_type: str, player_id: str):
         status="waiting"
     )
     await db.game_sessions.insert_one(game_session.dict())
+    await change_counters.bump("game_sessions")
+    game = game_engine.add(game_session.dict())
+    await manager.subscribe_user(player_id, f"game:{game_session.id}")
     
     # Broadcast game creation
     await manager.broadcast({
@@ -487,35 +2154,69 @@ async def create_game_session(game_type: str, player_id: str):
         "host_id": player_id
     })
     
-    return game_session
+    return public_session(game.session)
+
+async def backfill_game_versions():
+    """Give sessions created before versioning a version to compare-and-set against"""
+    await db.game_sessions.update_many({"version": {"$exists": False}}, {"$set": {"version": 0}})
+
+async def upgrade_legacy_games():
+    """Convert sessions stored in the pre-registry state encoding.
+
+    States the rules can convert are rewritten in place. Unfinished sessions that
+    cannot be converted, or whose game type no longer exists, are marked completed so
+    they drop out of the lobby; loading any of them answers 410.
+    """
+    legacy = [{"game_type": {"$nin": list(GAME_RULES)}}] + [
+        {"game_type": game_type, f"game_state.{rules.legacy_key}": {"$exists": True}}
+        for game_type, rules in GAME_RULES.items() if rules.legacy_key
+    ]
+    async for session in db.game_sessions.find({"$or": legacy}, {"_id": 0, "id": 1, "game_type": 1, "game_state": 1, "status": 1}):
+        rules = GAME_RULES.get(session["game_type"])
+        game_state = rules.upgrade(session["game_state"]) if rules else None
+        if game_state is not None:
+            changes = {"game_state": game_state}
+        elif session.get("status") != "completed":
+            changes = {"status": "completed"}
+        else:
+            continue
+        await db.game_sessions.update_one({"id": session["id"]}, {"$set": changes, "$inc": {"version": 1}})
 
 @api_router.post("/games/{game_id}/join")
 async def join_game(game_id: str, player_id: str):
     """Join an existing game session"""
-    game = await db.game_sessions.find_one({"id": game_id})
-    if not game:
-        raise HTTPException(status_code=404, detail="Game not found")
-    
-    if player_id in game["players"]:
-        return {"status": "already_joined"}
-    
-    # Add player and start game if we have enough players
-    players = game["players"] + [player_id]
-    status = "active" if len(players) >= get_min_players(game["game_type"]) else "waiting"
-    
-    await db.game_sessions.update_one(
-        {"id": game_id},
-        {
-            "$set": {
+    for _ in range(GAME_CAS_RETRIES):
+        async with game_engine.locked(game_id) as game:
+            if game is None:
+                raise HTTPException(status_code=404, detail="Game not found")
+            session = game.session
+            
+            if player_id in session["players"]:
+                return {"status": "already_joined"}
+            if len(session["players"]) >= game.rules.max_players or session["status"] != "waiting":
+                raise HTTPException(status_code=409, detail="Game is full")
+            
+            # Add player and start game if we have enough players
+            players = session["players"] + [player_id]
+            status = "active" if len(players) >= game.rules.min_players else "waiting"
+            
+            # Membership changes are rare, so they are written through
+            if await game_engine.write_session(game, {
                 "players": players,
                 "status": status,
                 "updated_at": datetime.utcnow()
-            }
-        }
-    )
+            }):
+                break
+            # Someone else joined or moved since we loaded the game
+            game_engine.evict(game)
+    else:
+        raise HTTPException(status_code=409, detail="Game changed concurrently, please retry")
     
-    # Broadcast game join
-    await manager.broadcast({
+    await change_counters.bump("game_sessions")
+    
+    # Notify the game room, including the player who just joined
+    await manager.subscribe_user(player_id, f"game:{game_id}")
+    await manager.publish(f"game:{game_id}", {
         "type": "player_joined",
         "game_id": game_id,
         "player_id": player_id,
@@ -527,72 +2228,377 @@ async def join_game(game_id: str, player_id: str):
 @api_router.post("/games/{game_id}/move")
 async def make_game_move(game_id: str, move: GameMove):
     """Make a move in a game"""
-    game = await db.game_sessions.find_one({"id": game_id})
-    if not game:
-        raise HTTPException(status_code=404, detail="Game not found")
-    
-    if move.player_id not in game["players"]:
-        raise HTTPException(status_code=403, detail="Player not in game")
-    
-    # Process move based on game type
-    new_game_state, game_status, winner = process_game_move(
-        game["game_type"], 
-        game["game_state"], 
-        move.move_data, 
-        move.player_id
-    )
-    
-    # Update game state
-    update_data = {
-        "game_state": new_game_state,
-        "status": game_status,
-        "updated_at": datetime.utcnow()
-    }
-    
-    if winner:
-        update_data["winner"] = winner
+    # With several workers, a join handled elsewhere may not be in our copy yet
+    may_be_stale = GAME_MOVE_WRITES == "through"
+    for _ in range(GAME_CAS_RETRIES):
+        async with game_engine.locked(game_id) as game:
+            if game is None:
+                raise HTTPException(status_code=404, detail="Game not found")
+            session = game.session
+            
+            if may_be_stale and (move.player_id not in session["players"] or session["status"] == "waiting"):
+                game_engine.evict(game)
+                may_be_stale = False
+                continue
+            if move.player_id not in session["players"]:
+                raise HTTPException(status_code=403, detail="Player not in game")
+            
+            if move.move_id in game.move_ids:
+                return duplicate_move_response(game, game.move_ids[move.move_id])
+            
+            # Process move based on game type; state is persisted in the background
+            previous_state = game.public_state()
+            try:
+                await game_engine.move(game, move.player_id, move.move_data, move.move_id)
+            except InvalidMove as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            except GameConflict:
+                # Another worker moved first; retry against the reloaded game
+                continue
+            delta = diff_game_state(previous_state, game.public_state())
+            seq = session["seq"]
+            game_status = session["status"]
+            winner = session.get("winner")
+            break
+    else:
+        raise HTTPException(status_code=409, detail="Game changed concurrently, please retry")
     
-    await db.game_sessions.update_one(
-        {"id": game_id},
-        {"$set": update_data}
-    )
+    await change_counters.bump("game_sessions")
     
-    # Broadcast move to all players
-    await manager.broadcast({
+    # Broadcast only what changed; clients that miss a seq fetch a snapshot. The raw
+    # move_data is not echoed, it can hold what the state keeps private (a trivia answer)
+    await manager.publish(f"game:{game_id}", {
         "type": "game_move",
         "game_id": game_id,
         "player_id": move.player_id,
-        "move_data": move.move_data,
-        "game_state": new_game_state,
+        "seq": seq,
+        "delta": delta,
         "status": game_status,
         "winner": winner
     })
     
     return {
         "status": "success",
-        "game_state": new_game_state,
+        "seq": seq,
+        "delta": delta,
         "game_status": game_status,
         "winner": winner
     }
 
+def duplicate_move_response(game: ActiveGame, seq: int) -> Dict[str, Any]:
+    """Answer a retried move with the update it originally produced"""
+    session = game.session
+    before, after = game.state_at(seq - 1), game.state_at(seq)
+    if before is None or after is None:
+        # Too old to diff; the full current state is a valid update for any client
+        seq, delta = session["seq"], game.public_state()
+    else:
+        delta = diff_game_state(before, after)
+    return {
+        "status": "duplicate",
+        "seq": seq,
+        "delta": delta,
+        "game_status": session["status"],
+        "winner": session.get("winner")
+    }
+
+@api_router.get("/games/{game_id}/snapshot")
+async def get_game_snapshot(game_id: str, seq: Optional[int] = None):
+    """Game state at the given seq (default: the latest), for clients resyncing after a gap"""
+    game = await game_engine.get(game_id)
+    if game is None:
+        raise HTTPException(status_code=404, detail="Game not found")
+    session = game.session
+    if seq is None or seq == session.get("seq", 0):
+        return {
+            "seq": session.get("seq", 0),
+            "game_state": game.public_state(),
+            "status": session["status"],
+            "winner": session.get("winner")
+        }
+    
+    game_state = game.state_at(seq)
+    if game_state is None:
+        raise HTTPException(status_code=410, detail="State at that seq is no longer available")
+    return {"seq": seq, "game_state": game_state}
+
+@api_router.get("/games/rules/{game_type}")
+async def get_game_rules_content(game_type: str):
+    """Static content for a game type, used by clients to render its compact state"""
+    rules = GAME_RULES.get(game_type)
+    if rules is None:
+        raise HTTPException(status_code=404, detail="Unknown game type")
+    return {
+        "game_type": game_type,
+        "min_players": rules.min_players,
+        "max_players": rules.max_players,
+        "content": rules.content()
+    }
+
 @api_router.get("/games/{game_id}", response_model=GameSession)
-async def get_game_session(game_id: str):
+async def get_game_session(game_id: str, request: Request, response: Response):
     """Get game session details"""
-    game = await db.game_sessions.find_one({"id": game_id})
-    if not game:
+    game = await game_engine.get(game_id)
+    if game is None:
         raise HTTPException(status_code=404, detail="Game not found")
-    return GameSession(**game)
+    # The live session is in memory, so it can be validated exactly
+    session = game.session
+    unchanged = not_modified(request, response, f'"{game_id}-{session.get("seq", 0)}-{session.get("version", 0)}"')
+    if unchanged:
+        return unchanged
+    return GameSession(**public_session(game.session))
 
 @api_router.get("/games", response_model=List[GameSession])
-async def get_active_games(status: str = "active"):
+async def get_active_games(request: Request, response: Response, status: str = "active"):
     """Get active game sessions"""
-    games = await db.game_sessions.find({"status": status}).sort("created_at", -1).to_list(20)
-    return [GameSession(**game) for game in games]
+    unchanged = collection_not_modified(request, response, "game_sessions")
+    if unchanged:
+        return unchanged
+    games = await db.game_sessions.find({"status": status}, {"_id": 0}).sort("created_at", -1).to_list(20)
+    # Games being played here are ahead of their last snapshot
+    live = [game_engine.games.get(game["id"]) for game in games]
+    sessions = [public_session(active.session if active else game) for active, game in zip(live, games)]
+    return render_documents("get_active_games", GameSession, sessions, response)
 
 # =============================================================================
 # WATCH TOGETHER
 # =============================================================================
 
+WATCH_CHAT_BUFFER_SIZE = int(os.environ.get("WATCH_CHAT_BUFFER_SIZE", "200"))
+WATCH_CHAT_FLUSH_INTERVAL = float(os.environ.get("WATCH_CHAT_FLUSH_INTERVAL", "2"))
+WATCH_CHAT_MAX_PENDING = 50000
+WATCH_CHAT_IDLE_SECONDS = 3600
+
+class WatchChatStore:
+    """Recent chat per watch session kept in memory, persisted in batches.
+
+    Messages go into a bounded ring buffer that late joiners are served from, and
+    into a pending list that is flushed to the append-only ``watch_chat`` collection
+    by a periodic task, so sending a message never waits on Mongo. Buffers of sessions
+    nobody touched for WATCH_CHAT_IDLE_SECONDS are dropped and reseeded on next use.
+    """
+
+    def __init__(self):
+        self.recent_messages: Dict[str, deque] = {}
+        self.last_used: Dict[str, float] = {}
+        self.pending: List[Dict[str, Any]] = []
+
+    async def _buffer(self, session_id: str) -> deque:
+        self.last_used[session_id] = time.monotonic()
+        buffer = self.recent_messages.get(session_id)
+        if buffer is None:
+            # First touch in this process: seed from what was persisted before
+            history = await db.watch_chat.find(
+                {"session_id": session_id}, {"_id": 0, "session_id": 0}
+            ).sort("timestamp", -1).limit(WATCH_CHAT_BUFFER_SIZE).to_list(WATCH_CHAT_BUFFER_SIZE)
+            if not history:
+                session = await db.watch_sessions.find_one(
+                    {"id": session_id}, {"chat_messages": {"$slice": -WATCH_CHAT_BUFFER_SIZE}}
+                )
+                history = list(reversed((session or {}).get("chat_messages", [])))
+            buffer = self.recent_messages.setdefault(
+                session_id, deque(reversed(history), maxlen=WATCH_CHAT_BUFFER_SIZE)
+            )
+        return buffer
+
+    async def add(self, session_id: str, message: Dict[str, Any]):
+        (await self._buffer(session_id)).append(message)
+        if len(self.pending) >= WATCH_CHAT_MAX_PENDING:
+            logger.warning("Watch chat persistence is falling behind, dropping oldest pending message")
+            self.pending.pop(0)
+        self.pending.append({**message, "session_id": session_id})
+
+    def add_relayed(self, payload: Dict[str, Any]):
+        """Chat sent through another worker: only update the buffer, that worker persists it"""
+        buffer = self.recent_messages.get(payload["session_id"])
+        if buffer is not None:
+            buffer.append(payload["message"])
+            self.last_used[payload["session_id"]] = time.monotonic()
+
+    async def recent(self, session_id: str, limit: int = WATCH_CHAT_BUFFER_SIZE) -> List[Dict[str, Any]]:
+        buffer = await self._buffer(session_id)
+        return list(buffer)[-limit:] if limit > 0 else []
+
+    def evict_idle(self):
+        now = time.monotonic()
+        for session_id, last_used in list(self.last_used.items()):
+            if now - last_used > WATCH_CHAT_IDLE_SECONDS:
+                del self.last_used[session_id]
+                self.recent_messages.pop(session_id, None)
+
+    async def flush(self):
+        self.evict_idle()
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        # Anything that failed goes back in front for the next flush
+        self.pending = await insert_write_behind(db.watch_chat, batch) + self.pending
+
+watch_chat = WatchChatStore()
+manager.on_relay("watch_chat", watch_chat.add_relayed)
+run_periodically("watch_chat_flush", WATCH_CHAT_FLUSH_INTERVAL, watch_chat.flush)
+
+WATCH_SYNC_INTERVAL = float(os.environ.get("WATCH_SYNC_INTERVAL", "2"))
+WATCH_SNAPSHOT_INTERVAL = float(os.environ.get("WATCH_SNAPSHOT_INTERVAL", "10"))
+WATCH_STATE_IDLE_SECONDS = 3600
+
+class PlaybackState:
+    """Authoritative playback position of one watch session.
+
+    ``position`` is where playback was at ``updated_at`` (server monotonic clock), so the
+    current position is derived on demand instead of being written on every tick.
+    """
+
+    __slots__ = ("session_id", "participants", "position", "is_playing", "rate", "updated_at", "dirty")
+
+    def __init__(self, session_id: str, participants: List[str], position: float, is_playing: bool, rate: float):
+        self.session_id = session_id
+        self.participants = set(participants)
+        self.position = position
+        self.is_playing = is_playing
+        self.rate = rate
+        self.updated_at = time.monotonic()
+        self.dirty = False
+
+    def current_position(self, now: Optional[float] = None) -> float:
+        if not self.is_playing:
+            return self.position
+        now = time.monotonic() if now is None else now
+        return self.position + (now - self.updated_at) * self.rate
+
+    def apply(self, action: str, timestamp: Optional[float], rate: Optional[float]) -> bool:
+        """Apply a control action; returns False when it changes nothing"""
+        if action == "play":
+            changed = not self.is_playing
+        elif action == "pause":
+            changed = self.is_playing
+        elif action == "seek":
+            changed = timestamp is not None
+        elif action == "rate":
+            changed = rate is not None and rate > 0 and rate != self.rate
+        else:
+            changed = False
+        if not changed:
+            return False
+        
+        # Re-anchor at the current position before changing anything
+        now = time.monotonic()
+        self.position = self.current_position(now)
+        self.updated_at = now
+        if action == "play":
+            self.is_playing = True
+        elif action == "pause":
+            self.is_playing = False
+        elif action == "seek":
+            self.position = max(timestamp, 0.0)
+        else:
+            self.rate = rate
+        self.dirty = True
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Wire form: the position at ``server_time`` (wall clock, seconds)"""
+        return {
+            "session_id": self.session_id,
+            "position": self.current_position(),
+            "is_playing": self.is_playing,
+            "rate": self.rate,
+            "server_time": time.time()
+        }
+
+    def restore(self, snapshot: Dict[str, Any]):
+        """Adopt a snapshot produced by another worker"""
+        elapsed = max(time.time() - snapshot["server_time"], 0.0)
+        self.is_playing = snapshot["is_playing"]
+        self.rate = snapshot["rate"]
+        self.position = snapshot["position"] + (elapsed * self.rate if self.is_playing else 0.0)
+        self.updated_at = time.monotonic()
+
+class PlaybackClock:
+    """In-memory playback state per watch session, snapshotted to Mongo periodically"""
+
+    def __init__(self):
+        self.states: Dict[str, PlaybackState] = {}
+
+    async def get(self, session_id: str, document: Optional[Dict[str, Any]] = None) -> Optional[PlaybackState]:
+        state = self.states.get(session_id)
+        if state is None:
+            if document is None:
+                document = await db.watch_sessions.find_one(
+                    {"id": session_id},
+                    {"participants": 1, "current_time": 1, "is_playing": 1, "playback_rate": 1}
+                )
+                if not document:
+                    return None
+            state = self.states.setdefault(session_id, PlaybackState(
+                session_id,
+                document.get("participants", []),
+                document.get("current_time", 0.0),
+                document.get("is_playing", False),
+                document.get("playback_rate", 1.0)
+            ))
+        return state
+
+    def add_participant(self, session_id: str, user_id: str):
+        state = self.states.get(session_id)
+        if state is not None:
+            state.participants.add(user_id)
+
+    def add_relayed_participant(self, payload: Dict[str, Any]):
+        self.add_participant(payload["session_id"], payload["user_id"])
+
+    def apply_relayed(self, payload: Dict[str, Any]):
+        state = self.states.get(payload["session_id"])
+        if state is not None:
+            state.restore(payload)
+
+    async def sync_tick(self):
+        """Push the authoritative clock to this worker's viewers of every playing session"""
+        for state in list(self.states.values()):
+            topic = f"watch:{state.session_id}"
+            if state.is_playing and topic in manager.topics:
+                await manager.publish(topic, {"type": "watch_sync", **state.snapshot()}, relay=False)
+
+    async def snapshot_to_db(self):
+        now = time.monotonic()
+        operations = []
+        written: List[PlaybackState] = []
+        for session_id, state in list(self.states.items()):
+            if state.dirty:
+                written.append(state)
+                operations.append(UpdateOne(
+                    {"id": session_id},
+                    {"$set": {
+                        "current_time": state.current_position(now),
+                        "is_playing": state.is_playing,
+                        "playback_rate": state.rate
+                    }}
+                ))
+                state.dirty = False
+            elif not state.is_playing and now - state.updated_at > WATCH_STATE_IDLE_SECONDS:
+                del self.states[session_id]
+        if not operations:
+            return
+        # Flags are cleared up front so control actions during the write mark the state
+        # dirty again; whatever failed is marked dirty for the next snapshot
+        try:
+            await db.watch_sessions.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            failed = [written[error["index"]] for error in e.details.get("writeErrors", [])]
+            logger.warning(f"Playback snapshot failed for {len(failed)} watch sessions")
+            for state in failed:
+                state.dirty = True
+        except Exception as e:
+            logger.warning(f"Playback snapshot failed: {e}")
+            for state in written:
+                state.dirty = True
+
+playback_clock = PlaybackClock()
+manager.on_relay("watch_playback", playback_clock.apply_relayed)
+manager.on_relay("watch_join", playback_clock.add_relayed_participant)
+run_periodically("watch_sync", WATCH_SYNC_INTERVAL, playback_clock.sync_tick)
+run_periodically("watch_snapshot", WATCH_SNAPSHOT_INTERVAL, playback_clock.snapshot_to_db)
+
 @api_router.post("/watch/create", response_model=WatchSession)
 async def create_watch_session(host_id: str, session_data: WatchSessionCreate):
     """Create a new watch together session"""
@@ -602,6 +2608,7 @@ async def create_watch_session(host_id: str, session_data: WatchSessionCreate):
         **session_data.dict()
     )
     await db.watch_sessions.insert_one(watch_session.dict())
+    await manager.subscribe_user(host_id, f"watch:{watch_session.id}")
     
     # Broadcast session creation
     await manager.broadcast({
@@ -620,58 +2627,58 @@ async def join_watch_session(session_id: str, user_id: str):
     if not session:
         raise HTTPException(status_code=404, detail="Watch session not found")
     
+    await manager.subscribe_user(user_id, f"watch:{session_id}")
+    state = await playback_clock.get(session_id, document=session)
+    state.participants.add(user_id)
+    await manager.relay("watch_join", {"session_id": session_id, "user_id": user_id})
+    
     if user_id not in session["participants"]:
         participants = session["participants"] + [user_id]
         await db.watch_sessions.update_one(
             {"id": session_id},
             {"$set": {"participants": participants}}
         )
+        await document_cache.invalidate("watch_sessions", session_id)
         
-        # Broadcast join
-        await manager.broadcast({
+        # Notify the watch room
+        await manager.publish(f"watch:{session_id}", {
             "type": "user_joined_watch",
             "session_id": session_id,
             "user_id": user_id
         })
     
-    return {"status": "joined"}
+    return {
+        "status": "joined",
+        "playback": state.snapshot(),
+        "recent_chat": await watch_chat.recent(session_id)
+    }
 
 @api_router.post("/watch/{session_id}/control")
 async def control_watch_session(session_id: str, user_id: str, control: WatchControl):
-    """Control video playback (play/pause/seek)"""
-    session = await db.watch_sessions.find_one({"id": session_id})
-    if not session:
+    """Control video playback (play/pause/seek/rate)"""
+    state = await playback_clock.get(session_id)
+    if state is None:
         raise HTTPException(status_code=404, detail="Watch session not found")
     
-    if user_id not in session["participants"]:
+    if user_id not in state.participants:
         raise HTTPException(status_code=403, detail="User not in session")
     
-    # Update session state
-    update_data = {}
-    if control.action == "play":
-        update_data["is_playing"] = True
-    elif control.action == "pause":
-        update_data["is_playing"] = False
-    elif control.action == "seek" and control.timestamp is not None:
-        update_data["current_time"] = control.timestamp
-    
-    if update_data:
-        await db.watch_sessions.update_one(
-            {"id": session_id},
-            {"$set": update_data}
-        )
+    # Playback state lives in memory and is snapshotted to Mongo periodically
+    if state.apply(control.action, control.timestamp, control.rate):
+        snapshot = state.snapshot()
+        await manager.relay("watch_playback", snapshot)
         
-        # Broadcast control action
-        await manager.broadcast({
+        # Broadcast control action to the watch room
+        await manager.publish(f"watch:{session_id}", {
             "type": "watch_control",
             "session_id": session_id,
             "user_id": user_id,
             "action": control.action,
             "timestamp": control.timestamp,
-            "is_playing": update_data.get("is_playing", session["is_playing"])
+            **snapshot
         })
     
-    return {"status": "success"}
+    return {"status": "success", "playback": state.snapshot()}
 
 @api_router.post("/watch/{session_id}/chat")
 async def send_watch_chat(session_id: str, user_id: str, message: str):
@@ -683,13 +2690,11 @@ async def send_watch_chat(session_id: str, user_id: str, message: str):
         "timestamp": datetime.utcnow().isoformat()
     }
     
-    await db.watch_sessions.update_one(
-        {"id": session_id},
-        {"$push": {"chat_messages": chat_message}}
-    )
+    await watch_chat.add(session_id, chat_message)
+    await manager.relay("watch_chat", {"session_id": session_id, "message": chat_message})
     
-    # Broadcast chat message
-    await manager.broadcast({
+    # Broadcast chat message to the watch room
+    await manager.publish(f"watch:{session_id}", {
         "type": "watch_chat",
         "session_id": session_id,
         "message": chat_message
@@ -699,11 +2704,21 @@ async def send_watch_chat(session_id: str, user_id: str, message: str):
 
 @api_router.get("/watch/{session_id}", response_model=WatchSession)
 async def get_watch_session(session_id: str):
-    """Get watch session details"""
-    session = await db.watch_sessions.find_one({"id": session_id})
+    """Get watch session details with the most recent chat"""
+    session = await document_cache.get("watch_sessions", session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Watch session not found")
-    return WatchSession(**session)
+    
+    # The in-memory clock is ahead of the last snapshot
+    state = playback_clock.states.get(session_id)
+    if state is not None:
+        session.update(current_time=state.current_position(), is_playing=state.is_playing, playback_rate=state.rate)
+    return WatchSession(**session, chat_messages=await watch_chat.recent(session_id))
+
+@api_router.get("/watch/{session_id}/chat")
+async def get_watch_chat(session_id: str, limit: int = 50):
+    """Get the most recent chat messages of a watch session, oldest first"""
+    return {"messages": await watch_chat.recent(session_id, limit)}
 
 # =============================================================================
 # VIDEO CALLING
@@ -787,212 +2802,754 @@ async def end_video_call(call_id: str, user_id: str):
     
     return {"status": "ended", "duration": duration}
 
+# =============================================================================
+# PRESENCE
+# =============================================================================
+
+PRESENCE_TOPIC = "presence"
+PRESENCE_FLUSH_INTERVAL = float(os.environ.get("PRESENCE_FLUSH_INTERVAL", "5"))
+# A worker that has not announced its users for this many flushes is presumed dead
+PRESENCE_NODE_EXPIRY = 3
+
+class PresenceRegistry:
+    """Who is online, answered from memory.
+
+    A user is online while they have a socket on any worker. Local sockets come from
+    the connection manager; other workers relay their online users on every change and
+    as a full list every PRESENCE_FLUSH_INTERVAL. Online/offline transitions are pushed
+    to subscribers of the ``presence`` topic, and ``is_online``/``last_active`` are
+    written to ``users`` in one batch per interval.
+    """
+
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex
+        # node_id -> (when it last announced, users online there)
+        self.remote: Dict[str, Tuple[float, Set[str]]] = {}
+        # user_id -> fields to write on the next flush
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        # Users announced as online from this worker
+        self.local: Set[str] = set()
+
+    def is_online(self, user_id: str) -> bool:
+        if user_id in manager.user_connections:
+            return True
+        return any(user_id in users for _, users in self.remote.values())
+
+    def online_users(self) -> Set[str]:
+        online = set(manager.user_connections)
+        for _, users in self.remote.values():
+            online |= users
+        return online
+
+    def _notify(self, was_online: Dict[str, bool]):
+        for user_id, before in was_online.items():
+            now = self.is_online(user_id)
+            if now != before:
+                manager.publish_local(PRESENCE_TOPIC, {"type": "presence", "user_id": user_id, "online": now})
+
+    async def connected(self, user_id: str, was_online: bool):
+        """Call after the socket has been added to the connection manager"""
+        self._notify({user_id: was_online})
+        self.pending[user_id] = {"is_online": True, "last_active": datetime.utcnow()}
+        if user_id not in self.local:
+            self.local.add(user_id)
+            await manager.relay("presence", {"node": self.node_id, "user_id": user_id, "online": True})
+
+    async def disconnected(self, user_id: str):
+        """Call after the socket has been removed from the connection manager; idempotent"""
+        if user_id in manager.user_connections or user_id not in self.local:
+            return  # another tab is still open, or already handled
+        self.local.discard(user_id)
+        self._notify({user_id: True})
+        self.pending[user_id] = {"is_online": self.is_online(user_id), "last_active": datetime.utcnow()}
+        await manager.relay("presence", {"node": self.node_id, "user_id": user_id, "online": False})
+
+    def touch(self, user_id: str):
+        """Record activity; written with the next flush rather than per message"""
+        self.pending.setdefault(user_id, {})["last_active"] = datetime.utcnow()
+
+    def _on_relay(self, payload: dict):
+        node = payload["node"]
+        _, before = self.remote.get(node, (0.0, set()))
+        if "users" in payload:
+            after = set(payload["users"])
+        else:
+            after = set(before)
+            if payload["online"]:
+                after.add(payload["user_id"])
+            else:
+                after.discard(payload["user_id"])
+        was_online = {user_id: self.is_online(user_id) for user_id in before ^ after}
+        self.remote[node] = (time.monotonic(), after)
+        self._notify(was_online)
+
+    def _expire_nodes(self):
+        cutoff = time.monotonic() - PRESENCE_FLUSH_INTERVAL * PRESENCE_NODE_EXPIRY
+        for node, (seen_at, users) in list(self.remote.items()):
+            if seen_at < cutoff:
+                was_online = {user_id: self.is_online(user_id) for user_id in users}
+                del self.remote[node]
+                self._notify(was_online)
+
+    async def flush(self):
+        self._expire_nodes()
+        await manager.relay("presence", {"node": self.node_id, "users": list(manager.user_connections)})
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        try:
+            await db.users.bulk_write(
+                [UpdateOne({"id": user_id}, {"$set": fields}) for user_id, fields in batch.items()],
+                ordered=False
+            )
+        except Exception as e:
+            logger.warning(f"Presence flush failed for {len(batch)} users: {e}")
+            # Keep newer pending values over the failed ones
+            for user_id, fields in batch.items():
+                self.pending[user_id] = {**fields, **self.pending.get(user_id, {})}
+
+presence = PresenceRegistry()
+manager.on_relay("presence", presence._on_relay)
+run_periodically("presence_flush", PRESENCE_FLUSH_INTERVAL, presence.flush)
+
 # =============================================================================
 # WEBSOCKET ENDPOINT
 # =============================================================================
 
+TYPING_WINDOW = float(os.environ.get("TYPING_WINDOW", "3"))
+
+class TypingTracker:
+    """Coalesces typing frames into start/stop transitions per (user, context).
+
+    The first frame publishes ``typing: true`` to the context topic; further frames only
+    push the deadline TYPING_WINDOW out. An explicit stop, the deadline passing or the
+    user going away publishes ``typing: false``.
+    """
+
+    def __init__(self):
+        self.deadlines: Dict[Tuple[str, str], float] = {}
+
+    async def _publish(self, user_id: str, context: str, typing: bool):
+        await manager.publish(context, {
+            "type": "user_typing",
+            "user_id": user_id,
+            "context": context,
+            "typing": typing
+        })
+
+    async def typing(self, user_id: str, context: str):
+        key = (user_id, context)
+        started = key not in self.deadlines
+        self.deadlines[key] = time.monotonic() + TYPING_WINDOW
+        if started:
+            await self._publish(user_id, context, True)
+
+    async def stopped(self, user_id: str, context: str):
+        if self.deadlines.pop((user_id, context), None) is not None:
+            await self._publish(user_id, context, False)
+
+    async def stop_user(self, user_id: str):
+        for key in [key for key in self.deadlines if key[0] == user_id]:
+            await self.stopped(*key)
+
+    async def expire(self):
+        now = time.monotonic()
+        for key in [key for key, deadline in self.deadlines.items() if deadline <= now]:
+            await self.stopped(*key)
+
+typing_tracker = TypingTracker()
+run_periodically("typing_expiry", TYPING_WINDOW / 3, typing_tracker.expire)
+
+async def settle_user(user_id: str):
+    """Update presence and typing state after one of the user's sockets went away"""
+    await presence.disconnected(user_id)
+    if user_id not in manager.user_connections:
+        await typing_tracker.stop_user(user_id)
+
+async def reap_idle_connections():
+    # A vanished client may never make its receive loop fail, so settle presence here
+    for connection in manager.reap_idle():
+        await settle_user(connection.user_id)
+
+run_periodically("ws_keepalive", WS_PING_INTERVAL / 2, reap_idle_connections)
+
+@api_router.get("/ws/stats")
+async def get_websocket_stats():
+    """Connection counters for this worker"""
+    return {**manager.stats(), "online_users": len(presence.online_users())}
+
 @app.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: str):
-    await manager.connect(websocket, user_id)
-    
-    # Update user online status
-    await db.users.update_one(
-        {"id": user_id},
-        {"$set": {"is_online": True, "last_active": datetime.utcnow()}}
-    )
+async def websocket_endpoint(websocket: WebSocket, user_id: str, encoding: Optional[str] = None):
+    was_online = presence.is_online(user_id)
+    connection = await manager.connect(websocket, user_id, negotiate_encoding(encoding))
+    await presence.connected(user_id, was_online)
+    # Tells the client which encoding it got, e.g. JSON when msgpack is not installed
+    await manager.send(websocket, {"type": "connected", "encoding": connection.encoding})
     
     try:
         while True:
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            received = await websocket.receive()
+            if received["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(received.get("code", 1000))
+            connection.last_seen = time.monotonic()
+            try:
+                message = decode_client_frame(received)
+            except ValueError:
+                await manager.send(websocket, {"type": "error", "detail": "Malformed frame"})
+                continue
             
             # Handle different message types
             if message.get("type") == "heartbeat":
-                await websocket.send_text(json.dumps({"type": "heartbeat_ack"}))
-            elif message.get("type") == "typing":
-                # Broadcast typing indicator
-                await manager.broadcast({
-                    "type": "user_typing",
-                    "user_id": user_id,
-                    "context": message.get("context", "general")
+                presence.touch(user_id)
+                await manager.send(websocket, {"type": "heartbeat_ack"})
+            elif message.get("type") == "clock_sync":
+                # NTP-style handshake: the client estimates its offset from the round trip
+                await manager.send(websocket, {
+                    "type": "clock_sync",
+                    "client_time": message.get("client_time"),
+                    "server_time": time.time()
                 })
+            elif message.get("type") in ("subscribe", "unsubscribe"):
+                topic = message.get("topic", "")
+                if not is_valid_topic(topic):
+                    await manager.send(websocket, {"type": "error", "detail": f"Unknown topic: {topic}"})
+                    continue
+                if message["type"] == "subscribe":
+                    manager.subscribe(websocket, topic)
+                else:
+                    manager.unsubscribe(websocket, topic)
+                await manager.send(websocket, {"type": f"{message['type']}d", "topic": topic})
+            elif message.get("type") in ("typing", "typing_stop"):
+                # Typing indicators only reach the room they belong to
+                context = message.get("context", "")
+                if not manager.is_subscribed(websocket, context):
+                    continue
+                if message["type"] == "typing":
+                    await typing_tracker.typing(user_id, context)
+                else:
+                    await typing_tracker.stopped(user_id, context)
             
     except WebSocketDisconnect:
+        pass
+    finally:
+        # Also reached when the socket was evicted or the loop errored
         manager.disconnect(websocket, user_id)
-        
-        # Update user offline status
-        await db.users.update_one(
-            {"id": user_id},
-            {"$set": {"is_online": False, "last_active": datetime.utcnow()}}
-        )
+        await settle_user(user_id)
 
 # =============================================================================
-# GAME LOGIC HELPER FUNCTIONS
+# GAME RULES
 # =============================================================================
 
-def get_initial_game_state(game_type: str) -> Dict[str, Any]:
-    """Get initial game state for different game types"""
-    if game_type == "tic_tac_hearts":
-        return {
-            "board": [["" for _ in range(3)] for _ in range(3)],
-            "current_player": 0,
-            "moves": []
-        }
-    elif game_type == "love_trivia":
-        return {
-            "current_question": 0,
-            "scores": {},
-            "questions": get_trivia_questions(),
-            "answers": []
-        }
-    elif game_type == "memory_match":
-        return {
-            "cards": generate_memory_cards(),
-            "flipped": [],
-            "matched": [],
-            "current_player": 0,
-            "scores": {}
-        }
-    elif game_type == "word_love":
-        return {
-            "target_word": get_random_love_word(),
-            "guesses": [],
-            "current_guess": "",
-            "attempts": 0,
-            "max_attempts": 6
-        }
-    elif game_type == "distance_quest":
+class InvalidMove(ValueError):
+    """Raised by game rules for a move that is not allowed in the current state"""
+
+class GameRules:
+    """Rules for one game type.
+
+    State lives in a slotted object while the game is played and is encoded to a
+    compact dict (``to_wire``) for persistence and for clients. ``apply_move`` must
+    validate the whole move before changing the state, so a rejected move leaves
+    the state untouched, and returns ``(status, winner)``. ``to_wire`` and ``from_wire``
+    must not share mutable values with the state: encoded states are kept to diff against.
+    """
+
+    game_type = ""
+    min_players = 2
+    max_players = 2
+    state_class: Any = None
+    # Keys of the encoded state that are persisted but never sent to clients
+    private_keys: Tuple[str, ...] = ()
+    # A key only the encoding from before the rules registry had
+    legacy_key = ""
+
+    def new_state(self):
+        raise NotImplementedError
+
+    def public(self, game_state: Dict[str, Any]) -> Dict[str, Any]:
+        if not self.private_keys:
+            return game_state
+        return {key: value for key, value in game_state.items() if key not in self.private_keys}
+
+    def decode(self, data: Dict[str, Any]):
+        return self.state_class.from_wire(data)
+
+    def is_legacy(self, data: Dict[str, Any]) -> bool:
+        return self.legacy_key in data
+
+    def upgrade(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Encode a legacy state in the current format, or None if it cannot be converted"""
+        return None
+
+    def apply_move(self, state, players: List[str], player_id: str, move_data: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+        raise NotImplementedError
+
+    def content(self) -> Dict[str, Any]:
+        """Static content clients need to render the compact state"""
+        return {}
+
+GAME_RULES: Dict[str, GameRules] = {}
+
+def register_game(cls):
+    GAME_RULES[cls.game_type] = cls()
+    return cls
+
+def get_game_rules(game_type: str) -> GameRules:
+    rules = GAME_RULES.get(game_type)
+    if rules is None:
+        raise InvalidMove(f"Unknown game type: {game_type}")
+    return rules
+
+def expect_turn(players: List[str], turn: int, player_id: str) -> int:
+    if turn >= len(players) or players[turn] != player_id:
+        raise InvalidMove("Not your turn")
+    return turn
+
+def move_int(move_data: Dict[str, Any], key: str, upper: int) -> int:
+    value = move_data.get(key)
+    if not isinstance(value, int) or isinstance(value, bool) or not 0 <= value < upper:
+        raise InvalidMove(f"Invalid {key}")
+    return value
+
+def move_text(move_data: Dict[str, Any], key: str) -> str:
+    value = move_data.get(key)
+    if not isinstance(value, str) or not value.strip():
+        raise InvalidMove(f"Missing {key}")
+    return " ".join(value.lower().split())
+
+def winner_by_score(players: List[str], scores: List[int]) -> str:
+    if scores[0] == scores[1]:
+        return "draw"
+    return players[0] if scores[0] > scores[1] else players[1]
+
+# Tic-tac-hearts: one 9-bit board per player, cell = row * 3 + col
+TIC_TAC_FULL = 0b111111111
+TIC_TAC_LINES = (
+    0b000000111, 0b000111000, 0b111000000,  # rows
+    0b001001001, 0b010010010, 0b100100100,  # columns
+    0b100010001, 0b001010100                # diagonals
+)
+# Only lines through the cell just played can have been completed by it
+TIC_TAC_LINES_BY_CELL = tuple(
+    tuple(line for line in TIC_TAC_LINES if line >> cell & 1) for cell in range(9)
+)
+
+class TicTacState:
+    __slots__ = ("boards", "turn")
+
+    def __init__(self, boards: Optional[List[int]] = None, turn: int = 0):
+        self.boards = boards or [0, 0]
+        self.turn = turn
+
+    def to_wire(self) -> Dict[str, Any]:
+        return {"x": self.boards[0], "o": self.boards[1], "turn": self.turn}
+
+    @classmethod
+    def from_wire(cls, data: Dict[str, Any]):
+        return cls([data.get("x", 0), data.get("o", 0)], data.get("turn", 0))
+
+@register_game
+class TicTacHeartsRules(GameRules):
+    game_type = "tic_tac_hearts"
+    state_class = TicTacState
+    legacy_key = "board"
+
+    def new_state(self):
+        return TicTacState()
+
+    def apply_move(self, state, players, player_id, move_data):
+        player = expect_turn(players, state.turn, player_id)
+        cell = move_int(move_data, "row", 3) * 3 + move_int(move_data, "col", 3)
+        bit = 1 << cell
+        if (state.boards[0] | state.boards[1]) & bit:
+            raise InvalidMove("Cell already taken")
+        
+        state.boards[player] |= bit
+        board = state.boards[player]
+        if any(board & line == line for line in TIC_TAC_LINES_BY_CELL[cell]):
+            return "completed", player_id
+        if state.boards[0] | state.boards[1] == TIC_TAC_FULL:
+            return "completed", "draw"
+        state.turn = 1 - player
+        return "active", None
+
+    def upgrade(self, data):
+        # The old board held each player's symbol per cell
+        x_symbol = self.content()["symbols"][0]
+        boards = [0, 0]
+        cells = [symbol for row in data["board"] for symbol in row]
+        for cell, symbol in enumerate(cells[:9]):
+            if symbol:
+                boards[0 if symbol == x_symbol else 1] |= 1 << cell
+        return TicTacState(boards, data.get("current_player", 0)).to_wire()
+
+    def content(self):
+        return {"symbols": ["❤️", "💙"]}
+
+# Love trivia: one partner answers about themselves, the other guesses the answer
+TRIVIA_QUESTIONS = [
+    {
+        "question": "What's your favorite memory together?",
+        "type": "open",
+        "points": 10
+    },
+    {
+        "question": "When did we first meet?",
+        "type": "date",
+        "points": 15
+    },
+    {
+        "question": "What's my favorite color?",
+        "type": "multiple_choice",
+        "options": ["Red", "Blue", "Green", "Purple"],
+        "points": 5
+    }
+]
+
+class TriviaState:
+    __slots__ = ("question", "turn", "answer", "scores")
+
+    def __init__(self, question: int = 0, turn: int = 0, answer: Optional[str] = None, scores: Optional[List[int]] = None):
+        self.question = question
+        self.turn = turn
+        self.answer = answer
+        self.scores = scores or [0, 0]
+
+    def to_wire(self) -> Dict[str, Any]:
         return {
-            "level": 1,
-            "player_positions": {},
-            "items_collected": {},
-            "challenges": get_quest_challenges()
+            "q": self.question,
+            "turn": self.turn,
+            "answered": self.answer is not None,
+            "answer": self.answer,
+            "scores": list(self.scores)
         }
-    elif game_type == "love_puzzles":
+
+    @classmethod
+    def from_wire(cls, data: Dict[str, Any]):
+        return cls(data.get("q", 0), data.get("turn", 0), data.get("answer"), list(data.get("scores") or [0, 0]))
+
+@register_game
+class LoveTriviaRules(GameRules):
+    game_type = "love_trivia"
+    state_class = TriviaState
+    legacy_key = "questions"
+    # The subject's answer would give it away to the partner who has to guess it
+    private_keys = ("answer",)
+
+    def new_state(self):
+        return TriviaState()
+
+    def apply_move(self, state, players, player_id, move_data):
+        player = expect_turn(players, state.turn, player_id)
+        if move_data.get("question_index", state.question) != state.question:
+            raise InvalidMove("Question already answered")
+        answer = move_text(move_data, "answer")
+        question = TRIVIA_QUESTIONS[state.question]
+        
+        if state.answer is None and question["type"] != "open":
+            # The subject answers first; their partner guesses next
+            state.answer = answer
+            state.turn = 1 - player
+            return "active", None
+        
+        if question["type"] == "open":
+            # Nothing to match: answering together scores for both
+            state.scores[0] += question["points"]
+            state.scores[1] += question["points"]
+        elif answer == state.answer:
+            state.scores[player] += question["points"]
+        
+        state.question += 1
+        state.answer = None
+        if state.question == len(TRIVIA_QUESTIONS):
+            return "completed", winner_by_score(players, state.scores)
+        state.turn = state.question % 2
+        return "active", None
+
+    def content(self):
+        return {"questions": TRIVIA_QUESTIONS}
+
+# Memory match: deck as symbol indexes, flipped and matched cards as bitsets
+MEMORY_SYMBOLS = ["❤️", "💙", "💚", "💛", "💜", "🧡", "🤍", "🖤"]
+MEMORY_CARDS = len(MEMORY_SYMBOLS) * 2
+MEMORY_ALL_MATCHED = (1 << MEMORY_CARDS) - 1
+
+class MemoryState:
+    __slots__ = ("deck", "flipped", "matched", "turn", "scores")
+
+    def __init__(self, deck: str, flipped: int = 0, matched: int = 0, turn: int = 0, scores: Optional[List[int]] = None):
+        self.deck = deck
+        self.flipped = flipped
+        self.matched = matched
+        self.turn = turn
+        self.scores = scores or [0, 0]
+
+    def to_wire(self) -> Dict[str, Any]:
         return {
-            "puzzle_pieces": generate_puzzle_pieces(),
-            "placed_pieces": {},
-            "completed": False
+            "deck": self.deck,
+            "flipped": self.flipped,
+            "matched": self.matched,
+            "turn": self.turn,
+            "scores": list(self.scores)
         }
-    
-    return {}
-
-def get_min_players(game_type: str) -> int:
-    """Get minimum players required for game type"""
-    return 2  # Most games require 2 players
 
-def process_game_move(game_type: str, game_state: Dict[str, Any], move_data: Dict[str, Any], player_id: str):
-    """Process a game move and return new state"""
-    if game_type == "tic_tac_hearts":
-        return process_tic_tac_move(game_state, move_data, player_id)
-    elif game_type == "love_trivia":
-        return process_trivia_move(game_state, move_data, player_id)
-    elif game_type == "memory_match":
-        return process_memory_move(game_state, move_data, player_id)
-    # Add more game types...
-    
-    return game_state, "active", None
+    @classmethod
+    def from_wire(cls, data: Dict[str, Any]):
+        return cls(data.get("deck", ""), data.get("flipped", 0), data.get("matched", 0), data.get("turn", 0), list(data.get("scores") or [0, 0]))
+
+@register_game
+class MemoryMatchRules(GameRules):
+    game_type = "memory_match"
+    state_class = MemoryState
+    legacy_key = "cards"
+
+    def new_state(self):
+        deck = [str(symbol) for symbol in range(len(MEMORY_SYMBOLS))] * 2
+        random.shuffle(deck)
+        return MemoryState("".join(deck))
+
+    def apply_move(self, state, players, player_id, move_data):
+        player = expect_turn(players, state.turn, player_id)
+        card = move_int(move_data, "card_index", MEMORY_CARDS)
+        bit = 1 << card
+        # A mismatched pair stays face up until the next card is flipped
+        flipped = 0 if state.flipped & (state.flipped - 1) else state.flipped
+        if (state.matched | flipped) & bit:
+            raise InvalidMove("Card already turned over")
+        
+        if not flipped:
+            state.flipped = bit
+            return "active", None
+        
+        first = flipped.bit_length() - 1
+        state.flipped = flipped | bit
+        if state.deck[first] != state.deck[card]:
+            state.turn = 1 - player
+            return "active", None
+        
+        # A match keeps the turn
+        state.matched |= state.flipped
+        state.flipped = 0
+        state.scores[player] += 1
+        if state.matched == MEMORY_ALL_MATCHED:
+            return "completed", winner_by_score(players, state.scores)
+        return "active", None
+
+    def content(self):
+        return {"symbols": MEMORY_SYMBOLS}
+
+# Word love: partners take turns guessing, feedback per letter is
+# "c" (right place), "p" (elsewhere in the word) or "a" (absent)
+LOVE_WORDS = ["HEART", "SWEET", "HONEY", "ANGEL", "DARLING", "BELOVED"]
+WORD_MAX_ATTEMPTS = 6
+
+def score_guess(guess: str, target: str) -> str:
+    marks = ["a"] * len(guess)
+    remaining: Dict[str, int] = {}
+    for i, (letter, expected) in enumerate(zip(guess, target)):
+        if letter == expected:
+            marks[i] = "c"
+        else:
+            remaining[expected] = remaining.get(expected, 0) + 1
+    for i, letter in enumerate(guess):
+        if marks[i] != "c" and remaining.get(letter):
+            marks[i] = "p"
+            remaining[letter] -= 1
+    return "".join(marks)
+
+class WordState:
+    __slots__ = ("word", "guesses", "turn")
+
+    def __init__(self, word: int, guesses: Optional[List[List[str]]] = None, turn: int = 0):
+        self.word = word
+        self.guesses = guesses or []
+        self.turn = turn
+
+    def to_wire(self) -> Dict[str, Any]:
+        return {"word": self.word, "guesses": [list(guess) for guess in self.guesses], "turn": self.turn}
+
+    @classmethod
+    def from_wire(cls, data: Dict[str, Any]):
+        return cls(data.get("word", 0), [list(guess) for guess in data.get("guesses") or []], data.get("turn", 0))
+
+@register_game
+class WordLoveRules(GameRules):
+    game_type = "word_love"
+    state_class = WordState
+    legacy_key = "target_word"
+
+    def new_state(self):
+        return WordState(random.randrange(len(LOVE_WORDS)))
+
+    def apply_move(self, state, players, player_id, move_data):
+        player = expect_turn(players, state.turn, player_id)
+        target = LOVE_WORDS[state.word]
+        guess = move_text(move_data, "guess").upper()
+        if len(guess) != len(target) or not guess.isalpha():
+            raise InvalidMove(f"Guess must be a {len(target)} letter word")
+        
+        state.guesses = state.guesses + [[guess, score_guess(guess, target)]]
+        if guess == target:
+            return "completed", player_id
+        if len(state.guesses) >= WORD_MAX_ATTEMPTS:
+            return "completed", "draw"
+        state.turn = 1 - player
+        return "active", None
+
+    def content(self):
+        return {"word_lengths": [len(word) for word in LOVE_WORDS], "max_attempts": WORD_MAX_ATTEMPTS}
+
+# Distance quest: cooperative, a level is cleared once every player has done its challenge
+QUEST_CHALLENGES = [
+    {"id": 1, "type": "riddle", "content": "I am always with you, even when apart. What am I?"},
+    {"id": 2, "type": "task", "content": "Send a virtual hug to your partner"},
+    {"id": 3, "type": "memory", "content": "Share your favorite moment together"}
+]
+QUEST_RIDDLE_ANSWERS = {1: {"love", "my love", "heart", "my heart", "our love"}}
+
+class QuestState:
+    __slots__ = ("level", "done", "items")
+
+    def __init__(self, level: int = 1, done: int = 0, items: Optional[List[int]] = None):
+        self.level = level
+        self.done = done
+        self.items = items or [0, 0]
+
+    def to_wire(self) -> Dict[str, Any]:
+        return {"level": self.level, "done": self.done, "items": list(self.items)}
+
+    @classmethod
+    def from_wire(cls, data: Dict[str, Any]):
+        return cls(data.get("level", 1), data.get("done", 0), list(data.get("items") or [0, 0]))
+
+@register_game
+class DistanceQuestRules(GameRules):
+    game_type = "distance_quest"
+    state_class = QuestState
+    legacy_key = "challenges"
+
+    def new_state(self):
+        return QuestState()
+
+    def apply_move(self, state, players, player_id, move_data):
+        player = players.index(player_id)
+        challenge = QUEST_CHALLENGES[state.level - 1]
+        if move_data.get("challenge_id", challenge["id"]) != challenge["id"]:
+            raise InvalidMove("Not the current challenge")
+        if state.done >> player & 1:
+            raise InvalidMove("Waiting for your partner")
+        response = move_text(move_data, "response")
+        accepted = QUEST_RIDDLE_ANSWERS.get(challenge["id"])
+        if accepted is not None and response not in accepted:
+            raise InvalidMove("Not quite, try again")
+        
+        state.done |= 1 << player
+        state.items[player] += 1
+        if state.done == (1 << len(players)) - 1:
+            state.level += 1
+            state.done = 0
+        if state.level > len(QUEST_CHALLENGES):
+            return "completed", None
+        return "active", None
+
+    def content(self):
+        return {"challenges": QUEST_CHALLENGES}
+
+# Love puzzles: cooperative; piece i belongs in cell i of a 4x4 grid
+PUZZLE_SIZE = 4
+PUZZLE_PIECES = PUZZLE_SIZE * PUZZLE_SIZE
+PUZZLE_SOLVED = (1 << PUZZLE_PIECES) - 1
+PUZZLE_UNPLACED = "."
+
+class PuzzleState:
+    __slots__ = ("positions", "cells", "correct")
+
+    def __init__(self, positions: Optional[List[int]] = None):
+        # positions[piece] -> cell (-1 when unplaced); cells[cell] -> piece (-1 when empty)
+        self.positions = positions or [-1] * PUZZLE_PIECES
+        self.cells = [-1] * PUZZLE_PIECES
+        self.correct = 0
+        for piece, cell in enumerate(self.positions):
+            if cell >= 0:
+                self.cells[cell] = piece
+                if cell == piece:
+                    self.correct |= 1 << piece
+
+    def to_wire(self) -> Dict[str, Any]:
+        # One hex digit per piece: the cell it sits in, or "." if not placed yet
+        placed = "".join(PUZZLE_UNPLACED if cell < 0 else format(cell, "x") for cell in self.positions)
+        return {"pos": placed, "correct": self.correct}
+
+    @classmethod
+    def from_wire(cls, data: Dict[str, Any]):
+        placed = data.get("pos") or PUZZLE_UNPLACED * PUZZLE_PIECES
+        return cls([-1 if char == PUZZLE_UNPLACED else int(char, 16) for char in placed])
+
+    def place(self, piece: int, cell: int):
+        self.positions[piece] = cell
+        self.correct &= ~(1 << piece)
+        if cell >= 0:
+            self.cells[cell] = piece
+            if cell == piece:
+                self.correct |= 1 << piece
+
+@register_game
+class LovePuzzlesRules(GameRules):
+    game_type = "love_puzzles"
+    state_class = PuzzleState
+    legacy_key = "puzzle_pieces"
+
+    def new_state(self):
+        return PuzzleState()
+
+    def apply_move(self, state, players, player_id, move_data):
+        piece = move_int(move_data, "piece", PUZZLE_PIECES)
+        cell = move_int(move_data, "y", PUZZLE_SIZE) * PUZZLE_SIZE + move_int(move_data, "x", PUZZLE_SIZE)
+        source = state.positions[piece]
+        if source == cell:
+            raise InvalidMove("Piece is already there")
+        
+        # Dropping onto an occupied cell swaps the two pieces
+        displaced = state.cells[cell]
+        if source >= 0:
+            state.cells[source] = -1
+        state.place(piece, cell)
+        if displaced >= 0:
+            state.place(displaced, source)
+        
+        if state.correct == PUZZLE_SOLVED:
+            return "completed", None
+        return "active", None
 
-def process_tic_tac_move(game_state: Dict[str, Any], move_data: Dict[str, Any], player_id: str):
-    """Process tic-tac-toe move"""
-    row, col = move_data["row"], move_data["col"]
-    board = game_state["board"]
-    
-    if board[row][col] != "":
-        return game_state, "active", None  # Invalid move
-    
-    # Place move
-    symbol = "❤️" if game_state["current_player"] == 0 else "💙"
-    board[row][col] = symbol
-    
-    # Check for win
-    winner = check_tic_tac_winner(board)
-    if winner:
-        return {**game_state, "board": board}, "completed", player_id
-    
-    # Check for draw
-    if all(cell != "" for row in board for cell in row):
-        return {**game_state, "board": board}, "completed", "draw"
-    
-    # Switch player
-    return {
-        **game_state,
-        "board": board,
-        "current_player": 1 - game_state["current_player"]
-    }, "active", None
-
-def check_tic_tac_winner(board):
-    """Check if there's a winner in tic-tac-toe"""
-    # Check rows, columns, and diagonals
-    for i in range(3):
-        if board[i][0] == board[i][1] == board[i][2] != "":
-            return board[i][0]
-        if board[0][i] == board[1][i] == board[2][i] != "":
-            return board[0][i]
-    
-    if board[0][0] == board[1][1] == board[2][2] != "":
-        return board[0][0]
-    if board[0][2] == board[1][1] == board[2][0] != "":
-        return board[0][2]
-    
-    return None
+    def content(self):
+        return {"size": PUZZLE_SIZE}
 
-def get_trivia_questions():
-    """Get love trivia questions"""
-    return [
-        {
-            "question": "What's your favorite memory together?",
-            "type": "open",
-            "points": 10
-        },
-        {
-            "question": "When did we first meet?",
-            "type": "date",
-            "points": 15
-        },
-        {
-            "question": "What's my favorite color?",
-            "type": "multiple_choice",
-            "options": ["Red", "Blue", "Green", "Purple"],
-            "points": 5
-        }
-    ]
+def get_initial_game_state(game_type: str) -> Dict[str, Any]:
+    """Get initial game state for different game types"""
+    return get_game_rules(game_type).new_state().to_wire()
 
-def generate_memory_cards():
-    """Generate memory match cards"""
-    symbols = ["❤️", "💙", "💚", "💛", "💜", "🧡", "🤍", "🖤"]
-    cards = symbols + symbols  # Duplicate for matching
-    import random
-    random.shuffle(cards)
-    return cards
-
-def get_random_love_word():
-    """Get random word for word love game"""
-    words = ["HEART", "SWEET", "HONEY", "ANGEL", "DARLING", "BELOVED"]
-    import random
-    return random.choice(words)
-
-def generate_puzzle_pieces():
-    """Generate puzzle pieces"""
-    return [{"id": i, "x": 0, "y": 0, "correct_x": i % 4, "correct_y": i // 4} for i in range(16)]
-
-def get_quest_challenges():
-    """Get distance quest challenges"""
-    return [
-        {"id": 1, "type": "riddle", "content": "I am always with you, even when apart. What am I?"},
-        {"id": 2, "type": "task", "content": "Send a virtual hug to your partner"},
-        {"id": 3, "type": "memory", "content": "Share your favorite moment together"}
-    ]
+# =============================================================================
+# LIFECYCLE
+# =============================================================================
 
-def process_trivia_move(game_state: Dict[str, Any], move_data: Dict[str, Any], player_id: str):
-    """Process trivia game move"""
-    # Implementation for trivia game logic
-    return game_state, "active", None
+@app.on_event("startup")
+async def start_services():
+    await manager.start()
+    check_conditional_gets()
+    for task in periodic_tasks:
+        task.start()
+    await bootstrap_indexes()
+    await backfill_like_counts()
+    await backfill_game_versions()
+    await upgrade_legacy_games()
+    await migrate_embedded_comments()
 
-def process_memory_move(game_state: Dict[str, Any], move_data: Dict[str, Any], player_id: str):
-    """Process memory match game move"""
-    # Implementation for memory game logic
-    return game_state, "active", None
+@app.on_event("shutdown")
+async def stop_services():
+    for task in periodic_tasks:
+        await task.stop()
+    await manager.stop()
+    if thumbnail_pool is not None:
+        thumbnail_pool.shutdown(wait=False, cancel_futures=True)
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -1003,6 +3560,7 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
 
 # Configure logging
@@ -1022,6 +3580,7 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
 
 # Configure logging
@@ -62,8 +62,16 @@ const BirthdayWishes = ({ user }: BirthdayWishesProps) => {
     if (user) {
       const ws = new WebSocket(`${backendUrl.replace('https://', 'wss://')}/ws/${user.id}`);
       
+      ws.onopen = () => {
+        ws.send(JSON.stringify({ type: 'subscribe', topic: 'wishes' }));
+      };
+      
       ws.onmessage = (event) => {
         const message = JSON.parse(event.data);
+        if (message.type === 'ping') {
+          ws.send(JSON.stringify({ type: 'pong' })); // Keepalive: quiet sockets get reaped
+          return;
+        }
         if (message.type === 'new_wish') {
           fetchWishes(); // Refresh wishes when new one is added
           toast({
@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { Card } from "@/components/ui/card";
 import { Button } from "@/components/ui/button";
 import { Gamepad2, Users, Trophy, Target, Heart, Zap, Star, Play, X } from "lucide-react";
@@ -62,10 +62,15 @@ const games = [
 ];
 
 // Tic Tac Toe Game Component
+// Game state arrives in a compact form: sets of cells/cards are bitmasks
+const hasBit = (mask, index) => ((mask || 0) >> index & 1) === 1;
+
 const TicTacHeartsGame = ({ user, gameSession, onBack, onMove }) => {
-  const board = gameSession.game_state.board || Array(3).fill(Array(3).fill(""));
-  const currentPlayer = gameSession.game_state.current_player || 0;
-  const isMyTurn = gameSession.players[currentPlayer] === user?.id;
+  const { x = 0, o = 0, turn = 0 } = gameSession.game_state;
+  const board = [0, 1, 2].map(row =>
+    [0, 1, 2].map(col => hasBit(x, row * 3 + col) ? "❤️" : hasBit(o, row * 3 + col) ? "💙" : "")
+  );
+  const isMyTurn = gameSession.players[turn] === user?.id;
   const myPlayerIndex = gameSession.players.indexOf(user?.id);
   const symbol = myPlayerIndex === 0 ? "❤️" : "💙";
   
@@ -124,17 +129,19 @@ const TicTacHeartsGame = ({ user, gameSession, onBack, onMove }) => {
 };
 
 // Love Trivia Game Component
-const LoveTriviaGame = ({ user, gameSession, onBack, onMove }) => {
+const LoveTriviaGame = ({ user, gameSession, content, onBack, onMove }) => {
   const gameState = gameSession.game_state;
-  const currentQuestion = gameState.questions?.[gameState.current_question];
-  const isMyTurn = gameSession.players[gameState.current_player || 0] === user?.id;
+  const questions = content?.questions || [];
+  const currentIndex = gameState.q || 0;
+  const currentQuestion = questions[currentIndex];
+  const isMyTurn = gameSession.players[gameState.turn || 0] === user?.id;
 
   const handleAnswer = (answer) => {
     if (!isMyTurn) return;
     
     onMove({
       answer,
-      question_index: gameState.current_question
+      question_index: currentIndex
     });
   };
 
@@ -161,7 +168,7 @@ const LoveTriviaGame = ({ user, gameSession, onBack, onMove }) => {
           Love Trivia ❤️
         </h3>
         <p className="text-primary-foreground/80">
-          Question {(gameState.current_question || 0) + 1} of {gameState.questions?.length || 0}
+          Question {currentIndex + 1} of {questions.length}
         </p>
       </div>
 
@@ -212,16 +219,19 @@ const LoveTriviaGame = ({ user, gameSession, onBack, onMove }) => {
 };
 
 // Memory Match Game Component
-const MemoryMatchGame = ({ user, gameSession, onBack, onMove }) => {
+const MemoryMatchGame = ({ user, gameSession, content, onBack, onMove }) => {
   const gameState = gameSession.game_state;
-  const cards = gameState.cards || [];
-  const flipped = gameState.flipped || [];
-  const matched = gameState.matched || [];
-  const currentPlayer = gameState.current_player || 0;
-  const isMyTurn = gameSession.players[currentPlayer] === user?.id;
+  const symbols = content?.symbols || [];
+  const cards = Array.from(gameState.deck || "", (symbol: string) => symbols[Number(symbol)] || "?");
+  const indexes = cards.map((_, index) => index);
+  const flipped = indexes.filter(index => hasBit(gameState.flipped, index));
+  const matched = indexes.filter(index => hasBit(gameState.matched, index));
+  const isMyTurn = gameSession.players[gameState.turn || 0] === user?.id;
 
   const handleCardClick = (index) => {
-    if (!isMyTurn || flipped.includes(index) || matched.includes(index) || flipped.length >= 2) return;
+    // A mismatched pair stays face up until the next card is flipped
+    const faceUp = flipped.length >= 2 ? [] : flipped;
+    if (!isMyTurn || faceUp.includes(index) || matched.includes(index)) return;
     
     onMove({
       card_index: index
@@ -274,25 +284,78 @@ const MultiplayerGames = ({ user }: MultiplayerGamesProps) => {
   const [gameSession, setGameSession] = useState(null);
   const [gameStats, setGameStats] = useState({ played: 12, wins: 7, partner_wins: 5 });
   const [isCreatingGame, setIsCreatingGame] = useState(false);
+  const [gameContent, setGameContent] = useState(null);
+  const sessionRef = useRef(null);
   const { toast } = useToast();
 
   const backendUrl = import.meta.env.VITE_REACT_APP_BACKEND_URL || "https://03269e3d-a03d-4889-a721-b4462c0d6feb.preview.emergentagent.com";
 
+  useEffect(() => {
+    // Questions, card symbols etc. are static per game type and not part of the game state
+    setGameContent(null);
+    if (!selectedGame) return;
+    fetch(`${backendUrl}/api/games/rules/${selectedGame.id}`)
+      .then(response => response.ok ? response.json() : null)
+      .then(rules => setGameContent(rules?.content || null))
+      .catch(error => console.error('Error fetching game rules:', error));
+  }, [selectedGame]);
+
+  useEffect(() => {
+    sessionRef.current = gameSession;
+  }, [gameSession]);
+
+  const resyncGame = async (gameId) => {
+    try {
+      const response = await fetch(`${backendUrl}/api/games/${gameId}/snapshot`);
+      if (!response.ok) return;
+      const snapshot = await response.json();
+      setGameSession(prev => prev && prev.id === gameId && snapshot.seq >= (prev.seq || 0) ? {
+        ...prev,
+        seq: snapshot.seq,
+        game_state: snapshot.game_state,
+        status: snapshot.status,
+        winner: snapshot.winner
+      } : prev);
+    } catch (error) {
+      console.error('Error resyncing game:', error);
+    }
+  };
+
+  // Moves carry a seq and only the changed state keys; a missed seq means we need a snapshot
+  const applyGameUpdate = (gameId, update) => {
+    const current = sessionRef.current;
+    if (!current || current.id !== gameId || update.seq <= (current.seq || 0)) return;
+    if (update.seq !== (current.seq || 0) + 1) {
+      resyncGame(gameId);
+      return;
+    }
+    setGameSession(prev => prev && prev.id === gameId && update.seq === (prev.seq || 0) + 1 ? {
+      ...prev,
+      seq: update.seq,
+      game_state: { ...prev.game_state, ...update.delta },
+      status: update.status,
+      winner: update.winner
+    } : prev);
+  };
+
   useEffect(() => {
     // Set up WebSocket connection for real-time game updates
     if (user && gameSession) {
       const ws = new WebSocket(`${backendUrl.replace('https://', 'wss://')}/ws/${user.id}`);
       
+      ws.onopen = () => {
+        ws.send(JSON.stringify({ type: 'subscribe', topic: `game:${gameSession.id}` }));
+      };
+      
       ws.onmessage = (event) => {
         const message = JSON.parse(event.data);
+        if (message.type === 'ping') {
+          ws.send(JSON.stringify({ type: 'pong' })); // Keepalive: quiet sockets get reaped
+          return;
+        }
         if (message.type === 'game_move' && message.game_id === gameSession.id) {
           // Update game state
-          setGameSession(prev => ({
-            ...prev,
-            game_state: message.game_state,
-            status: message.status,
-            winner: message.winner
-          }));
+          applyGameUpdate(gameSession.id, message);
           
           if (message.winner && message.winner !== "draw") {
             toast({
@@ -312,7 +375,7 @@ const MultiplayerGames = ({ user }: MultiplayerGamesProps) => {
         ws.close();
       };
     }
-  }, [user, gameSession]);
+  }, [user, gameSession?.id]);
 
   const createGame = async (game) => {
     if (!user) {
@@ -354,30 +417,33 @@ const MultiplayerGames = ({ user }: MultiplayerGamesProps) => {
   const makeMove = async (moveData) => {
     if (!gameSession || !user) return;
 
+    // The same move_id on a retry lets the server apply the move only once
+    const body = JSON.stringify({
+      game_id: gameSession.id,
+      player_id: user.id,
+      move_data: moveData,
+      move_id: crypto.randomUUID()
+    });
+    const sendMove = () => fetch(`${backendUrl}/api/games/${gameSession.id}/move`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body,
+    });
+
     try {
-      const response = await fetch(`${backendUrl}/api/games/${gameSession.id}/move`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          game_id: gameSession.id,
-          player_id: user.id,
-          move_data: moveData
-        }),
-      });
+      const response = await sendMove().catch(() => sendMove());
 
-      if (!response.ok) throw new Error('Failed to make move');
+      if (!response.ok) {
+        const error = await response.json().catch(() => null);
+        throw new Error(error?.detail || 'Failed to make move');
+      }
       
       const result = await response.json();
       
-      // Update local game state
-      setGameSession(prev => ({
-        ...prev,
-        game_state: result.game_state,
-        status: result.game_status,
-        winner: result.winner
-      }));
+      // Update local game state (unless the broadcast got here first)
+      applyGameUpdate(gameSession.id, { ...result, status: result.game_status });
       
     } catch (error: any) {
       toast({
@@ -399,9 +465,9 @@ const MultiplayerGames = ({ user }: MultiplayerGamesProps) => {
       case "tic_tac_hearts":
         return <TicTacHeartsGame user={user} gameSession={gameSession} onBack={exitGame} onMove={makeMove} />;
       case "love_trivia":
-        return <LoveTriviaGame user={user} gameSession={gameSession} onBack={exitGame} onMove={makeMove} />;
+        return <LoveTriviaGame user={user} gameSession={gameSession} content={gameContent} onBack={exitGame} onMove={makeMove} />;
       case "memory_match":
-        return <MemoryMatchGame user={user} gameSession={gameSession} onBack={exitGame} onMove={makeMove} />;
+        return <MemoryMatchGame user={user} gameSession={gameSession} content={gameContent} onBack={exitGame} onMove={makeMove} />;
       default:
         return (
           <Card className="p-8 bg-gradient-gaming shadow-glow">
@@ -11,18 +11,13 @@ interface Photo {
   user_id: string;
   title: string;
   description?: string;
-  image_data: string; // base64 encoded
-  thumbnail_data?: string;
   file_size: number;
   mime_type: string;
   uploaded_at: string;
-  likes: string[];
-  comments: Array<{
-    id: string;
-    user_id: string;
-    comment: string;
-    created_at: string;
-  }>;
+  like_count: number;
+  comment_count: number;
+  content_url: string;
+  thumbnail_url?: string | null;
   is_featured: boolean;
 }
 
@@ -37,6 +32,7 @@ const PhotoGallery = ({ user }: PhotoGalleryProps) => {
   const [selectedPhoto, setSelectedPhoto] = useState<Photo | null>(null);
   const [newComment, setNewComment] = useState("");
   const [isCommenting, setIsCommenting] = useState(false);
+  const [likedIds, setLikedIds] = useState<Set<string>>(new Set());
   const { toast } = useToast();
 
   const backendUrl = import.meta.env.VITE_REACT_APP_BACKEND_URL || "https://03269e3d-a03d-4889-a721-b4462c0d6feb.preview.emergentagent.com";
@@ -48,8 +44,19 @@ const PhotoGallery = ({ user }: PhotoGalleryProps) => {
     if (user) {
       const ws = new WebSocket(`${backendUrl.replace('https://', 'wss://')}/ws/${user.id}`);
       
+      ws.onopen = () => {
+        ws.send(JSON.stringify({ type: 'subscribe', topic: 'gallery' }));
+      };
+      
       ws.onmessage = (event) => {
         const message = JSON.parse(event.data);
+        if (message.type === 'ping') {
+          ws.send(JSON.stringify({ type: 'pong' })); // Keepalive: quiet sockets get reaped
+          return;
+        }
+        if (message.type === 'thumbnail_ready' && message.kind === 'photos') {
+          fetchPhotos(); // Swap in the generated thumbnail
+        }
         if (message.type === 'new_photo') {
           fetchPhotos(); // Refresh photos when new one is added
           toast({
@@ -72,6 +79,18 @@ const PhotoGallery = ({ user }: PhotoGalleryProps) => {
       
       const photosData = await response.json();
       setPhotos(photosData);
+      
+      if (user && photosData.length > 0) {
+        const likedResponse = await fetch(`${backendUrl}/api/reactions/liked`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ kind: 'photos', user_id: user.id, ids: photosData.map((item: Photo) => item.id) }),
+        });
+        if (likedResponse.ok) {
+          const { liked } = await likedResponse.json();
+          setLikedIds(new Set(liked));
+        }
+      }
     } catch (error) {
       console.error('Error fetching photos:', error);
       toast({
@@ -82,19 +101,6 @@ const PhotoGallery = ({ user }: PhotoGalleryProps) => {
     }
   };
 
-  const convertFileToBase64 = (file: File): Promise<string> => {
-    return new Promise((resolve, reject) => {
-      const reader = new FileReader();
-      reader.readAsDataURL(file);
-      reader.onload = () => {
-        const result = reader.result as string;
-        // Remove the data URL prefix to get just the base64 string
-        resolve(result.split(',')[1]);
-      };
-      reader.onerror = error => reject(error);
-    });
-  };
-
   const handleFileUpload = async (event: React.ChangeEvent<HTMLInputElement>) => {
     if (!user) {
       toast({
@@ -132,20 +138,13 @@ const PhotoGallery = ({ user }: PhotoGalleryProps) => {
       setIsUploading(true);
       
       try {
-        // Convert file to base64
-        const base64Data = await convertFileToBase64(file);
-        
-        const photoData = {
-          title: newCaption.trim() || "Beautiful memory ❤️",
-          description: newCaption.trim() || null,
-          image_data: base64Data,
-          mime_type: file.type,
-          file_size: file.size
-        };
-
         const formData = new FormData();
         formData.append('user_id', user.id);
-        formData.append('photo_data', JSON.stringify(photoData));
+        formData.append('title', newCaption.trim() || "Beautiful memory ❤️");
+        if (newCaption.trim()) {
+          formData.append('description', newCaption.trim());
+        }
+        formData.append('file', file);
 
         const response = await fetch(`${backendUrl}/api/photos`, {
           method: 'POST',
@@ -199,13 +198,17 @@ const PhotoGallery = ({ user }: PhotoGalleryProps) => {
       
       // Update the photo in local state
       setPhotos(prev => prev.map(p => 
-        p.id === photo.id 
-          ? { ...p, likes: result.status === 'liked' 
-              ? [...p.likes, user.id] 
-              : p.likes.filter(id => id !== user.id) 
-            }
-          : p
+        p.id === photo.id ? { ...p, like_count: result.total_likes } : p
       ));
+      setLikedIds(prev => {
+        const next = new Set(prev);
+        if (result.status === 'liked') {
+          next.add(photo.id);
+        } else {
+          next.delete(photo.id);
+        }
+        return next;
+      });
 
       toast({
         title: result.status === 'liked' ? "Photo Liked! ❤️" : "Like Removed",
@@ -252,9 +255,9 @@ const PhotoGallery = ({ user }: PhotoGalleryProps) => {
 
   const downloadPhoto = (photo: Photo) => {
     try {
-      // Create download link from base64 data
+      // Create download link to the photo content
       const link = document.createElement('a');
-      link.href = `data:${photo.mime_type};base64,${photo.image_data}`;
+      link.href = `${backendUrl}${photo.content_url}`;
       link.download = `noor-birthday-memory-${photo.id}.${photo.mime_type.split('/')[1]}`;
       document.body.appendChild(link);
       link.click();
@@ -348,7 +351,7 @@ const PhotoGallery = ({ user }: PhotoGalleryProps) => {
             <Card key={photo.id} className="overflow-hidden hover-scale bg-card/90 backdrop-blur-sm border-primary/10">
               <div className="aspect-square overflow-hidden cursor-pointer" onClick={() => setSelectedPhoto(photo)}>
                 <img
-                  src={`data:${photo.mime_type};base64,${photo.image_data}`}
+                  src={`${backendUrl}${photo.thumbnail_url || photo.content_url}`}
                   alt={photo.title}
                   className="w-full h-full object-cover transition-transform duration-300 hover:scale-110"
                 />
@@ -360,19 +363,19 @@ const PhotoGallery = ({ user }: PhotoGalleryProps) => {
                 <div className="flex items-center justify-between text-xs text-muted-foreground mb-3">
                   <span className="flex items-center gap-1">
                     <Heart className="w-3 h-3 text-primary" />
-                    {photo.likes.length} likes
+                    {photo.like_count} likes
                   </span>
                   <span>{new Date(photo.uploaded_at).toLocaleDateString()}</span>
                 </div>
                 <div className="flex gap-2 mb-3">
                   <Button
                     size="sm"
-                    variant={photo.likes.includes(user.id) ? "default" : "outline"}
+                    variant={likedIds.has(photo.id) ? "default" : "outline"}
                     onClick={() => likePhoto(photo)}
                     className="flex-1"
                   >
                     <ThumbsUp className="w-3 h-3 mr-1" />
-                    {photo.likes.includes(user.id) ? "Liked" : "Like"}
+                    {likedIds.has(photo.id) ? "Liked" : "Like"}
                   </Button>
                   <Button
                     size="sm"
@@ -386,10 +389,10 @@ const PhotoGallery = ({ user }: PhotoGalleryProps) => {
                 </div>
                 
                 {/* Comments Section */}
-                {photo.comments.length > 0 && (
+                {photo.comment_count > 0 && (
                   <div className="text-xs text-muted-foreground mb-2">
                     <MessageCircle className="w-3 h-3 inline mr-1" />
-                    {photo.comments.length} comment{photo.comments.length > 1 ? 's' : ''}
+                    {photo.comment_count} comment{photo.comment_count > 1 ? 's' : ''}
                   </div>
                 )}
                 
@@ -428,7 +431,7 @@ const PhotoGallery = ({ user }: PhotoGalleryProps) => {
         >
           <div className="max-w-4xl max-h-full bg-card rounded-lg overflow-hidden" onClick={e => e.stopPropagation()}>
             <img
-              src={`data:${selectedPhoto.mime_type};base64,${selectedPhoto.image_data}`}
+              src={`${backendUrl}${selectedPhoto.content_url}`}
               alt={selectedPhoto.title}
               className="w-full h-auto max-h-[70vh] object-contain"
             />
@@ -436,7 +439,7 @@ const PhotoGallery = ({ user }: PhotoGalleryProps) => {
               <h3 className="text-lg font-semibold mb-2">{selectedPhoto.title}</h3>
               <div className="flex items-center justify-between">
                 <span className="text-sm text-muted-foreground">
-                  {selectedPhoto.likes.length} likes • {selectedPhoto.comments.length} comments
+                  {selectedPhoto.like_count} likes • {selectedPhoto.comment_count} comments
                 </span>
                 <Button size="sm" onClick={() => setSelectedPhoto(null)}>
                   Close
@@ -11,19 +11,14 @@ interface Video {
   user_id: string;
   title: string;
   description?: string;
-  video_data: string; // base64 encoded
-  thumbnail_data?: string;
   file_size: number;
   mime_type: string;
   duration?: number;
   uploaded_at: string;
-  likes: string[];
-  comments: Array<{
-    id: string;
-    user_id: string;
-    comment: string;
-    created_at: string;
-  }>;
+  like_count: number;
+  comment_count: number;
+  content_url: string;
+  thumbnail_url?: string | null;
   views: number;
 }
 
@@ -39,6 +34,8 @@ const VideoGallery = ({ user }: VideoGalleryProps) => {
   const [isPlaying, setIsPlaying] = useState(false);
   const [videoTitle, setVideoTitle] = useState("");
   const [videoDescription, setVideoDescription] = useState("");
+  const [likedIds, setLikedIds] = useState<Set<string>>(new Set());
+  const [playbackId, setPlaybackId] = useState("");
   const videoRef = useRef<HTMLVideoElement>(null);
   const { toast } = useToast();
 
@@ -51,8 +48,19 @@ const VideoGallery = ({ user }: VideoGalleryProps) => {
     if (user) {
       const ws = new WebSocket(`${backendUrl.replace('https://', 'wss://')}/ws/${user.id}`);
       
+      ws.onopen = () => {
+        ws.send(JSON.stringify({ type: 'subscribe', topic: 'gallery' }));
+      };
+      
       ws.onmessage = (event) => {
         const message = JSON.parse(event.data);
+        if (message.type === 'ping') {
+          ws.send(JSON.stringify({ type: 'pong' })); // Keepalive: quiet sockets get reaped
+          return;
+        }
+        if (message.type === 'thumbnail_ready' && message.kind === 'videos') {
+          loadVideos(); // Swap in the generated thumbnail
+        }
         if (message.type === 'new_video') {
           loadVideos(); // Refresh videos when new one is added
           toast({
@@ -75,6 +83,18 @@ const VideoGallery = ({ user }: VideoGalleryProps) => {
       
       const videosData = await response.json();
       setVideos(videosData);
+      
+      if (user && videosData.length > 0) {
+        const likedResponse = await fetch(`${backendUrl}/api/reactions/liked`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ kind: 'videos', user_id: user.id, ids: videosData.map((item: Video) => item.id) }),
+        });
+        if (likedResponse.ok) {
+          const { liked } = await likedResponse.json();
+          setLikedIds(new Set(liked));
+        }
+      }
     } catch (error: any) {
       console.error('Error loading videos:', error);
       toast({
@@ -85,18 +105,6 @@ const VideoGallery = ({ user }: VideoGalleryProps) => {
     }
   };
 
-  const convertFileToBase64 = (file: File): Promise<string> => {
-    return new Promise((resolve, reject) => {
-      const reader = new FileReader();
-      reader.readAsDataURL(file);
-      reader.onload = () => {
-        const result = reader.result as string;
-        resolve(result.split(',')[1]); // Remove data URL prefix
-      };
-      reader.onerror = error => reject(error);
-    });
-  };
-
   const handleVideoUpload = async (event: React.ChangeEvent<HTMLInputElement>) => {
     if (!user) {
       toast({
@@ -145,9 +153,6 @@ const VideoGallery = ({ user }: VideoGalleryProps) => {
     setUploadProgress(0);
 
     try {
-      // Convert file to base64
-      const base64Data = await convertFileToBase64(file);
-      
       // Get video duration
       const video = document.createElement('video');
       video.src = URL.createObjectURL(file);
@@ -159,18 +164,14 @@ const VideoGallery = ({ user }: VideoGalleryProps) => {
         };
       });
 
-      const videoData = {
-        title: videoTitle,
-        description: videoDescription || null,
-        video_data: base64Data,
-        mime_type: file.type,
-        file_size: file.size,
-        duration: duration
-      };
-
       const formData = new FormData();
       formData.append('user_id', user.id);
-      formData.append('video_data', JSON.stringify(videoData));
+      formData.append('title', videoTitle);
+      if (videoDescription) {
+        formData.append('description', videoDescription);
+      }
+      formData.append('duration', String(duration));
+      formData.append('file', file);
 
       const response = await fetch(`${backendUrl}/api/videos`, {
         method: 'POST',
@@ -227,13 +228,20 @@ const VideoGallery = ({ user }: VideoGalleryProps) => {
       
       // Update the video in local state
       setVideos(prev => prev.map(v => 
-        v.id === video.id 
-          ? { ...v, likes: result.status === 'liked' 
-              ? [...v.likes, user.id] 
-              : v.likes.filter(id => id !== user.id) 
-            }
-          : v
+        v.id === video.id ? { ...v, like_count: result.total_likes } : v
       ));
+      setSelectedVideo(prev => 
+        prev && prev.id === video.id ? { ...prev, like_count: result.total_likes } : prev
+      );
+      setLikedIds(prev => {
+        const next = new Set(prev);
+        if (result.status === 'liked') {
+          next.add(video.id);
+        } else {
+          next.delete(video.id);
+        }
+        return next;
+      });
 
       toast({
         title: result.status === 'liked' ? "Video Liked! ❤️" : "Like Removed",
@@ -249,20 +257,12 @@ const VideoGallery = ({ user }: VideoGalleryProps) => {
   };
 
   const playVideo = async (video: Video) => {
-    // Track view
-    try {
-      await fetch(`${backendUrl}/api/videos/${video.id}`, {
-        method: 'GET',
-      });
-      
-      // Update local state to increment view count
-      setVideos(prev => prev.map(v => 
-        v.id === video.id ? { ...v, views: v.views + 1 } : v
-      ));
-    } catch (error) {
-      console.error('Error tracking view:', error);
-    }
+    // The stream endpoint counts one view per playback session
+    setVideos(prev => prev.map(v => 
+      v.id === video.id ? { ...v, views: v.views + 1 } : v
+    ));
 
+    setPlaybackId(crypto.randomUUID());
     setSelectedVideo(video);
     setIsPlaying(true);
   };
@@ -382,7 +382,7 @@ const VideoGallery = ({ user }: VideoGalleryProps) => {
                 </div>
                 <div className="flex items-center gap-2">
                   <Heart size={16} />
-                  <span className="text-sm">{selectedVideo.likes.length} likes</span>
+                  <span className="text-sm">{selectedVideo.like_count} likes</span>
                 </div>
               </div>
             </div>
@@ -390,7 +390,7 @@ const VideoGallery = ({ user }: VideoGalleryProps) => {
             <div className="aspect-video bg-card/20 rounded-lg overflow-hidden">
               <video
                 ref={videoRef}
-                src={`data:${selectedVideo.mime_type};base64,${selectedVideo.video_data}`}
+                src={`${backendUrl}/api/videos/${selectedVideo.id}/stream?playback=${playbackId}`}
                 className="w-full h-full object-cover"
                 controls
                 onPlay={() => setIsPlaying(true)}
@@ -415,12 +415,12 @@ const VideoGallery = ({ user }: VideoGalleryProps) => {
               </Button>
               
               <Button
-                variant={selectedVideo.likes.includes(user?.id) ? "default" : "outline"}
+                variant={likedIds.has(selectedVideo.id) ? "default" : "outline"}
                 onClick={() => likeVideo(selectedVideo)}
                 className="flex items-center gap-2"
               >
                 <ThumbsUp size={16} />
-                {selectedVideo.likes.includes(user?.id) ? "Liked" : "Like"} ({selectedVideo.likes.length})
+                {likedIds.has(selectedVideo.id) ? "Liked" : "Like"} ({selectedVideo.like_count})
               </Button>
               
               <Button
@@ -455,9 +455,9 @@ const VideoGallery = ({ user }: VideoGalleryProps) => {
               onClick={() => playVideo(video)}
             >
               <div className="aspect-video bg-gradient-romantic rounded-t-lg flex items-center justify-center relative overflow-hidden">
-                {video.thumbnail_data ? (
+                {video.thumbnail_url ? (
                   <img
-                    src={`data:image/jpeg;base64,${video.thumbnail_data}`}
+                    src={`${backendUrl}${video.thumbnail_url}`}
                     alt={video.title}
                     className="w-full h-full object-cover"
                   />
@@ -496,7 +496,7 @@ const VideoGallery = ({ user }: VideoGalleryProps) => {
                     </div>
                     <div className="flex items-center gap-1">
                       <Heart size={12} />
-                      <span>{video.likes.length}</span>
+                      <span>{video.like_count}</span>
                     </div>
                   </div>
                   <span>
@@ -0,0 +1,9 @@
+import os
+import sys
+from pathlib import Path
+
+# server.py reads these at import time; the client does not connect until it is used
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
@@ -0,0 +1,28 @@
+from fastapi import Request, Response
+
+import server
+
+
+def get_request(if_none_match=None, query=""):
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({"type": "http", "method": "GET", "path": "/api/photos", "query_string": query.encode(), "headers": headers})
+
+
+def test_unchanged_collection_answers_304(monkeypatch):
+    monkeypatch.setattr(server, "change_counters", server.ChangeCounters(enabled=True))
+    response = Response()
+    assert server.collection_not_modified(get_request(), response, "photos") is None
+    etag = response.headers["etag"]
+
+    assert server.collection_not_modified(get_request(etag), Response(), "photos").status_code == 304
+    assert server.collection_not_modified(get_request(etag, "limit=5"), Response(), "photos") is None
+    server.change_counters.increment("photos")
+    assert server.collection_not_modified(get_request(etag), Response(), "photos") is None
+
+
+def test_disabled_counters_never_answer_304(monkeypatch):
+    monkeypatch.setattr(server, "change_counters", server.ChangeCounters(enabled=False))
+    etag = f'W/"{server.change_counters.epoch}-0-{"0" * 12}"'
+    response = Response()
+    assert server.collection_not_modified(get_request(etag), response, "photos") is None
+    assert "etag" not in response.headers
@@ -0,0 +1,192 @@
+import asyncio
+import copy
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+
+class FakeMoves:
+    """game_moves whose inserts can be held open to interleave other work"""
+
+    def __init__(self):
+        self.documents = []
+        self.gate = None
+        self.started = asyncio.Event()
+        self.error = None
+
+    async def insert_one(self, document):
+        self.started.set()
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.error is not None:
+            raise self.error
+        self.documents.append(document)
+
+
+class FakeSessions:
+    """game_sessions that records every compare-and-set write"""
+
+    def __init__(self):
+        self.writes = []
+
+    async def update_one(self, query, update):
+        self.writes.append(dict(update["$set"]))
+        return SimpleNamespace(matched_count=1)
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    fake = SimpleNamespace(game_moves=FakeMoves(), game_sessions=FakeSessions())
+    monkeypatch.setattr(server, "db", fake)
+    monkeypatch.setattr(server, "GAME_MOVE_WRITES", "through")
+    return fake
+
+
+def game_session(game_type, game_state=None):
+    return {
+        "id": "game-1",
+        "game_type": game_type,
+        "players": ["alice", "bob"],
+        "game_state": game_state or server.get_initial_game_state(game_type),
+        "status": "active",
+        "seq": 0,
+        "version": 0,
+        "updated_at": datetime.utcnow()
+    }
+
+
+def tic_tac_session():
+    return game_session("tic_tac_hearts")
+
+
+def memory_session():
+    # Symbol i at cards i and i + 8
+    symbols = "".join(str(symbol) for symbol in range(server.MEMORY_CARDS // 2))
+    return game_session("memory_match", server.MemoryState(symbols * 2).to_wire())
+
+
+async def delta_of_move(engine, player_id, move_data):
+    """Apply a move the way make_game_move does and return the delta clients get"""
+    async with engine.locked("game-1") as game:
+        previous = game.public_state()
+        await engine.move(game, player_id, move_data)
+        return server.diff_game_state(previous, game.public_state())
+
+
+async def locked_move(engine, player_id, row, col):
+    await delta_of_move(engine, player_id, {"row": row, "col": col})
+
+
+def test_snapshot_waits_for_a_move_being_logged(fake_db):
+    async def scenario():
+        engine = server.GameEngine()
+        engine.add(tic_tac_session())
+        await locked_move(engine, "alice", 0, 0)
+
+        # Hold the second move inside its log write and snapshot meanwhile
+        fake_db.game_moves.gate = asyncio.Event()
+        fake_db.game_moves.started.clear()
+        move = asyncio.create_task(locked_move(engine, "bob", 1, 1))
+        await fake_db.game_moves.started.wait()
+        snapshot = asyncio.create_task(engine.snapshot_all())
+        await asyncio.sleep(0)
+        fake_db.game_moves.gate.set()
+        await asyncio.gather(move, snapshot)
+
+    asyncio.run(scenario())
+    # Every snapshot must pair a state with the seq of the last move it contains
+    for write in fake_db.game_sessions.writes:
+        assert (write["seq"], write["game_state"]) in [
+            (1, {"x": 0b1, "o": 0, "turn": 1}),
+            (2, {"x": 0b1, "o": 0b10000, "turn": 0}),
+        ]
+    assert fake_db.game_sessions.writes[-1]["seq"] == 2
+
+
+def test_failed_log_write_leaves_the_game_unchanged(fake_db):
+    fake_db.game_moves.error = RuntimeError("write concern timeout")
+
+    async def scenario():
+        engine = server.GameEngine()
+        game = engine.add(tic_tac_session())
+        with pytest.raises(RuntimeError):
+            await locked_move(engine, "alice", 0, 0)
+        await engine.snapshot_all()
+        return game
+
+    game = asyncio.run(scenario())
+    assert game.session["seq"] == 0
+    assert game.session["game_state"] == {"x": 0, "o": 0, "turn": 0}
+    assert game.state.boards == [0, 0]
+    assert not game.dirty
+    assert fake_db.game_sessions.writes == []
+
+
+def test_memory_match_delta_includes_scores(fake_db):
+    async def scenario():
+        engine = server.GameEngine()
+        engine.add(memory_session())
+        await delta_of_move(engine, "alice", {"card_index": 0})
+        return await delta_of_move(engine, "alice", {"card_index": 8})
+
+    assert asyncio.run(scenario()) == {"flipped": 0, "matched": 0b100000001, "scores": [1, 0]}
+
+
+def test_trivia_delta_includes_scores(fake_db):
+    async def scenario():
+        engine = server.GameEngine()
+        engine.add(game_session("love_trivia"))
+        return await delta_of_move(engine, "alice", {"answer": "Our first date"})
+
+    assert asyncio.run(scenario()) == {"q": 1, "turn": 1, "scores": [10, 10]}
+
+
+@pytest.mark.parametrize("session, moves", [
+    (memory_session, [("alice", {"card_index": 0}), ("alice", {"card_index": 8})]),
+    (lambda: game_session("love_trivia"), [("alice", {"answer": "Our first date"})]),
+])
+def test_failed_log_write_keeps_scores_unchanged(fake_db, session, moves):
+    async def scenario():
+        engine = server.GameEngine()
+        game = engine.add(session())
+        for player_id, move_data in moves[:-1]:
+            await delta_of_move(engine, player_id, move_data)
+        before = copy.deepcopy(game.session["game_state"])
+        fake_db.game_moves.error = RuntimeError("write concern timeout")
+        with pytest.raises(RuntimeError):
+            await delta_of_move(engine, *moves[-1])
+        return game, before
+
+    game, before = asyncio.run(scenario())
+    assert game.session["game_state"] == before
+    assert game.state.to_wire() == before
+
+
+def test_guesser_socket_never_sees_the_trivia_answer(fake_db, monkeypatch):
+    engine = server.GameEngine()
+    engine.add(game_session("love_trivia", {"q": 1, "turn": 0, "answered": False, "answer": None, "scores": [10, 10]}))
+    monkeypatch.setattr(server, "game_engine", engine)
+    # No startup: indexes, backfills and the backplane need a real database
+    monkeypatch.setattr(server.app.router, "on_startup", [])
+    monkeypatch.setattr(server.app.router, "on_shutdown", [])
+
+    with TestClient(server.app) as client, client.websocket_connect("/ws/bob") as guesser:
+        assert guesser.receive_json()["type"] == "connected"
+        guesser.send_json({"type": "subscribe", "topic": "game:game-1"})
+        assert guesser.receive_json()["type"] == "subscribed"
+
+        response = client.post("/api/games/game-1/move", json={
+            "game_id": "game-1", "player_id": "alice", "move_data": {"answer": "SECRET-date"}
+        })
+        assert response.status_code == 200
+        event = guesser.receive_json()
+
+    assert event["type"] == "game_move"
+    assert event["delta"] == {"turn": 1, "answered": True}
+    assert "SECRET" not in json.dumps(event).upper()
+    assert "SECRET" not in response.text.upper()
@@ -0,0 +1,168 @@
+import pytest
+
+from server import (
+    GAME_RULES, InvalidMove, MEMORY_CARDS, PUZZLE_PIECES, TIC_TAC_LINES, MemoryState,
+    get_game_rules, score_guess
+)
+
+PLAYERS = ["alice", "bob"]
+
+
+def play(game_type, state, moves):
+    rules = get_game_rules(game_type)
+    result = None
+    for player_id, move_data in moves:
+        result = rules.apply_move(state, PLAYERS, player_id, move_data)
+    return result
+
+
+def tic_tac(*cells):
+    """Alternate alice and bob over the given (row, col) cells"""
+    return [(PLAYERS[i % 2], {"row": row, "col": col}) for i, (row, col) in enumerate(cells)]
+
+
+@pytest.mark.parametrize("line", TIC_TAC_LINES)
+def test_tic_tac_every_line_wins(line):
+    cells = [cell for cell in range(9) if line >> cell & 1]
+    others = [cell for cell in range(9) if not line >> cell & 1]
+    # alice takes the line, bob plays elsewhere; bob never completes a line in 2 moves
+    order = [cells[0], others[0], cells[1], others[1], cells[2]]
+    state = GAME_RULES["tic_tac_hearts"].new_state()
+    result = play("tic_tac_hearts", state, tic_tac(*[divmod(cell, 3) for cell in order]))
+    assert result == ("completed", "alice")
+    assert state.boards[0] == line
+
+
+def test_tic_tac_full_board_is_a_draw():
+    state = GAME_RULES["tic_tac_hearts"].new_state()
+    result = play("tic_tac_hearts", state, tic_tac(
+        (0, 0), (0, 1), (0, 2), (1, 1), (1, 0), (1, 2), (2, 1), (2, 0), (2, 2)
+    ))
+    assert result == ("completed", "draw")
+    assert state.boards[0] | state.boards[1] == 0b111111111
+
+
+def test_tic_tac_wire_round_trip():
+    rules = GAME_RULES["tic_tac_hearts"]
+    state = rules.new_state()
+    play("tic_tac_hearts", state, tic_tac((0, 0), (1, 1)))
+    assert state.to_wire() == {"x": 0b1, "o": 0b10000, "turn": 0}
+    assert rules.decode(state.to_wire()).to_wire() == state.to_wire()
+
+
+def test_tic_tac_upgrades_the_legacy_board():
+    rules = GAME_RULES["tic_tac_hearts"]
+    legacy = {"board": [["❤️", "", ""], ["", "💙", ""], ["", "", "❤️"]], "current_player": 1, "moves": []}
+    assert rules.is_legacy(legacy)
+    assert rules.upgrade(legacy) == {"x": 0b100000001, "o": 0b10000, "turn": 1}
+
+
+def memory_deck():
+    # Symbol i at cards i and i + 8
+    symbols = "".join(str(symbol) for symbol in range(MEMORY_CARDS // 2))
+    return MemoryState(symbols * 2)
+
+
+def flip(player_id, card):
+    return (player_id, {"card_index": card})
+
+
+def test_memory_match_keeps_the_turn_and_scores():
+    state = memory_deck()
+    assert play("memory_match", state, [flip("alice", 0), flip("alice", 8)]) == ("active", None)
+    assert state.matched == 1 << 0 | 1 << 8
+    assert state.flipped == 0
+    assert state.scores == [1, 0]
+    assert state.turn == 0
+
+
+def test_memory_mismatch_stays_up_until_the_next_flip():
+    state = memory_deck()
+    play("memory_match", state, [flip("alice", 0), flip("alice", 1)])
+    assert state.flipped == 0b11
+    assert state.turn == 1
+    play("memory_match", state, [flip("bob", 0)])
+    assert state.flipped == 0b1
+
+
+def test_memory_all_matched_completes():
+    state = memory_deck()
+    moves = []
+    for symbol in range(MEMORY_CARDS // 2):
+        moves += [flip("alice", symbol), flip("alice", symbol + MEMORY_CARDS // 2)]
+    assert play("memory_match", state, moves) == ("completed", "alice")
+    assert state.matched == (1 << MEMORY_CARDS) - 1
+
+
+def puzzle_move(piece, cell):
+    y, x = divmod(cell, 4)
+    return ("alice", {"piece": piece, "x": x, "y": y})
+
+
+def test_puzzle_drop_on_an_occupied_cell_swaps():
+    state = GAME_RULES["love_puzzles"].new_state()
+    play("love_puzzles", state, [puzzle_move(0, 1), puzzle_move(1, 0)])
+    assert state.positions[:2] == [1, 0]
+    assert state.correct == 0
+    play("love_puzzles", state, [puzzle_move(0, 0)])
+    assert state.positions[:2] == [0, 1]
+    assert state.cells[:2] == [0, 1]
+    assert state.correct == 0b11
+
+
+def test_puzzle_wire_round_trip():
+    rules = GAME_RULES["love_puzzles"]
+    state = rules.new_state()
+    play("love_puzzles", state, [puzzle_move(3, 3), puzzle_move(2, 15)])
+    wire = state.to_wire()
+    assert wire == {"pos": "..f3" + "." * (PUZZLE_PIECES - 4), "correct": 0b1000}
+    decoded = rules.decode(wire)
+    assert decoded.cells[15] == 2 and decoded.correct == 0b1000
+
+
+def test_puzzle_solves():
+    state = GAME_RULES["love_puzzles"].new_state()
+    result = play("love_puzzles", state, [puzzle_move(piece, piece) for piece in range(PUZZLE_PIECES)])
+    assert result == ("completed", None)
+
+
+def test_trivia_answer_is_kept_private():
+    rules = GAME_RULES["love_trivia"]
+    state = rules.new_state()
+    play("love_trivia", state, [("alice", {"answer": "Our first date"}), ("bob", {"answer": "June 5"})])
+    wire = state.to_wire()
+    assert wire["answer"] == "june 5"
+    assert rules.public(wire) == {"q": 1, "turn": 0, "answered": True, "scores": [10, 10]}
+
+
+def test_score_guess_counts_repeated_letters_once():
+    assert score_guess("HEART", "HEART") == "ccccc"
+    assert score_guess("EEEEE", "SWEET") == "aacca"
+    assert score_guess("TEASE", "SWEET") == "ppapp"
+
+
+@pytest.mark.parametrize("game_type, setup, move", [
+    ("tic_tac_hearts", tic_tac((0, 0)), ("alice", {"row": 1, "col": 1})),
+    ("tic_tac_hearts", tic_tac((0, 0)), ("bob", {"row": 0, "col": 0})),
+    ("tic_tac_hearts", [], ("alice", {"row": 3, "col": 0})),
+    ("memory_match", [flip("alice", 0)], ("alice", {"card_index": 0})),
+    ("memory_match", [flip("alice", 0), flip("alice", 8)], ("alice", {"card_index": 8})),
+    ("love_puzzles", [puzzle_move(0, 5)], puzzle_move(0, 5)),
+    ("love_puzzles", [], ("alice", {"piece": 16, "x": 0, "y": 0})),
+    ("love_trivia", [], ("bob", {"answer": "together"})),
+    ("word_love", [], ("alice", {"guess": "TOOLONGWORD"})),
+    ("distance_quest", [], ("alice", {"response": "a guess"})),
+])
+def test_rejected_move_leaves_the_state_unchanged(game_type, setup, move):
+    rules = get_game_rules(game_type)
+    state = memory_deck() if game_type == "memory_match" else rules.new_state()
+    play(game_type, state, setup)
+    before = state.to_wire()
+    with pytest.raises(InvalidMove):
+        rules.apply_move(state, PLAYERS, *move)
+    assert state.to_wire() == before
+
+
+def test_unknown_game_type():
+    with pytest.raises(InvalidMove):
+        get_game_rules("chess")
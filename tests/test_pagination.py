@@ -0,0 +1,37 @@
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from server import decode_cursor, encode_cursor, keyset_query
+
+
+def test_cursor_round_trip():
+    uploaded_at = datetime(2024, 6, 5, 18, 30, 15, 123000)
+    cursor = encode_cursor(uploaded_at, "photo-42")
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (uploaded_at, "photo-42")
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", "bm90IGpzb24", "MQ", encode_cursor(datetime(2024, 1, 1), "x")[:-4]])
+def test_malformed_cursor_is_a_bad_request(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+def test_keyset_query_without_cursor_is_unchanged():
+    query = {"is_approved": True}
+    assert keyset_query(query, "created_at", None) is query
+
+
+def test_keyset_query_continues_after_the_cursor():
+    created_at = datetime(2024, 6, 5)
+    query = keyset_query({"is_approved": True}, "created_at", encode_cursor(created_at, "wish-7"))
+    assert query == {
+        "is_approved": True,
+        "$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": "wish-7"}}
+        ]
+    }
@@ -0,0 +1,32 @@
+import pytest
+
+from server import parse_byte_range
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("Bytes = 0-0", (0, 0)),
+])
+def test_satisfiable_ranges(header, expected):
+    assert parse_byte_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=500-100", "bytes=-0"])
+def test_unsatisfiable_ranges(header):
+    assert parse_byte_range(header, 1000) is None
+
+
+def test_suffix_range_of_an_empty_file_is_unsatisfiable():
+    assert parse_byte_range("bytes=-10", 0) is None
+
+
+@pytest.mark.parametrize("header", [
+    "items=0-10", "bytes=0-10,20-30", "bytes=abc-", "bytes=-", "bytes=--5", "bytes=5--3", "bytes=+5-", "bytes=5"
+])
+def test_unsupported_headers_raise(header):
+    with pytest.raises(ValueError):
+        parse_byte_range(header, 1000)